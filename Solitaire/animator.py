@@ -0,0 +1,75 @@
+from collections import deque
+
+from kivy.animation import Animation
+from kivy.clock import Clock
+
+# single queue for everything which is drawn over time - dealing, moves and replays.
+# Each step runs delay seconds after the one before it, checked once per frame, and
+# steps which fall due in the same frame run together so the total time does not
+# depend on the frame rate. Cards moved by a step can slide to their new place.
+class Animator(object):
+
+    def __init__(self):
+        self.queue = deque()
+        self.tweens = {}
+        self.event = None
+        self.last = 0
+
+    def busy(self): return bool(self.queue)
+
+    # queue fn(*args) to run delay seconds after the previous step
+    def add(self, delay, fn, *args):
+        if self.event is None:
+            self.last = Clock.time()
+            self.event = Clock.schedule_interval(self.tick, 0)
+        self.queue.append((delay, fn, args))
+
+    def tick(self, dt):
+        now = Clock.time()
+        while self.queue and self.last + self.queue[0][0] <= now:
+            delay, fn, args = self.queue.popleft()
+            self.last += delay
+            self.finish_tweens()
+            fn(*args)
+        if not self.queue: self.stop()
+
+    # run everything still queued straight away, including steps they add
+    def finish(self):
+        self.finish_tweens()
+        while self.queue:
+            delay, fn, args = self.queue.popleft()
+            fn(*args)
+        self.finish_tweens()
+        self.stop()
+
+    # throw away queued steps
+    def cancel(self):
+        self.queue.clear()
+        self.finish_tweens()
+        self.stop()
+
+    def stop(self):
+        if self.event is not None:
+            self.event.cancel()
+            self.event = None
+
+    # slide widgets from dx, dy away back to where they are now
+    def tween(self, widgets, dx, dy, duration):
+        if not (dx or dy) or duration <= 0: return
+        for w in widgets:
+            x, y = w.pos
+            w.pos = (x+dx, y+dy)
+            anim = Animation(pos=(x, y), d=duration, t='out_quad')
+            anim.bind(on_complete=self.on_tween_done)
+            self.tweens[w] = (anim, (x, y))
+            anim.start(w)
+
+    def on_tween_done(self, anim, widget):
+        self.tweens.pop(widget, None)
+
+    # jump tweens to the end before the widgets are changed again
+    def finish_tweens(self):
+        tweens, self.tweens = self.tweens, {}
+        for w, (anim, pos) in tweens.items():
+            anim.cancel(w)
+            w.pos = pos
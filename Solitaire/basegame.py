@@ -1,9 +1,18 @@
+import math
 from functools import partial
-from kivy.core.window import Window
-from kivy.config import Config
 from kivy.logger import Logger
 
-from cards import Card, Deck
+from cards import Card, Deck, FACEUP
+from board import Board
+from perf import timed
+from rules import CARD_MASK
+
+# area of intersection of two widgets
+def overlap(a, b):
+    w = min(a.right, b.right) - max(a.x, b.x)
+    h = min(a.top, b.top) - max(a.y, b.y)
+    return w*h if w > 0 and h > 0 else 0
+
 
 # game base class - specific games inherit from this
 class BaseGame(object):
@@ -15,55 +24,71 @@ class BaseGame(object):
     num_rows = 5
     x_padding, y_padding = 0.02, 0.02
     fan_pile_scale = 0.18
+    # build rules for each kind of pile, see rules.Rule
+    rules = {}
 
+    # with no root the game runs headless against the board model only
     def __init__(self, root=None, on_move=None, menu_size=0):
         self.menu_size = menu_size
-        self.set_scale(Window.width, Window.height, menu=menu_size)
-        self.layout = root.layout
-        self.move = on_move
+        self.layout = root.layout if root is not None else None
+        if self.layout is not None:
+            from kivy.core.window import Window
+            self.set_scale(Window.width, Window.height, menu=menu_size)
+        self.move = on_move or self.move_now
+        self.board = Board()
         self.piles = dict(tableau=[], foundation=[], waste=[])
         self.num_foundation = 4*self.decks
         self.max_score = 52*self.decks
         self.num_piles = self.num_tableau + self.num_foundation + self.num_waste
         self.won = False
+        self.grid = None
+        # compiled rules for each pile - (empty, table, group) from Rule.compile
+        self.compiled = {}
 
     # clear the board 
     def clear(self, base):
-        Logger.debug("Cards: clear game (base=%d)" % base)
+        Logger.debug("Cards: clear game (base=%d)", base)
         for _, group in list(self.piles.items()):
             for pile in group: pile.clear(base)
+        self.board.clear(base)
         self.won = False
+        if self.layout is not None:
+            from pile import POOL
+            Logger.info("Cards: widget pool %r", POOL.stats())
 
-    # called on window resize
-    def do_resize(self):
-        width, height = Window.width, Window.height
-        self.set_scale(width, height, menu=self.menu_size)
+    # called on window resize - scale is worked out once, then only piles which
+    # have moved or changed size are updated. Size defaults to the window's.
+    def do_resize(self, size=None):
+        if size is None:
+            from kivy.core.window import Window
+            size = Window.size
+        self.set_scale(size[0], size[1], menu=self.menu_size)
         for pile in self.all_piles():
+            old = pile.geometry()
             self.position_pile(pile)
-            pile.redraw()
-        Config.set('graphics', 'width', width)
-        Config.set('graphics', 'height', height)
-        Config.write()
+            pile.relayout(old)
 
     # split window into rows and cols
     def set_scale(self, width, height, menu=0):
-        Logger.info("Cards: window size = %d x %d" % (width, height))
+        Logger.info("Cards: window size = %d x %d", width, height)
         self.padding = int(self.x_padding*width), int(self.y_padding*height)
+        # pile counters are sized by size_hint in the kv file
+        self.counter_size = 0.03*width, 0.03*height
         h = (height-menu)/self.num_rows - self.padding[1]
         csize = self._set_cell_size(int(h/Card.aspect_ratio), int(h))
         if self.num_cols*csize[0] <= width:
             self.x0 = int((width-csize[0]*self.num_cols)/2) + self.padding[0]/2
             self.y0 = height + self.padding[1]/2
-            Logger.debug("Cards: set scale from window height: origin = %d %d" % (self.x0,self.y0))
+            Logger.debug("Cards: set scale from window height: origin = %d %d", self.x0,self.y0)
         else:
             w = width/self.num_cols - self.padding[0]
             csize = self._set_cell_size(w, int(w*Card.aspect_ratio))
             self.x0 = self.padding[0]/2
             self.y0 = height + self.padding[1]/2
-            Logger.debug("Cards: set scale from window width: origin = %d %d" % (self.x0,self.y0))
-        Logger.info("Cards: card size = %d x %d" % self.card_size)
+            Logger.debug("Cards: set scale from window width: origin = %d %d", self.x0,self.y0)
+        Logger.info("Cards: card size = %d x %d", *self.card_size)
         self.fan_pile = int(self.fan_pile_scale*self.card_size[1])
-        Logger.info("Cards: fan pile =  %d" % self.fan_pile)
+        Logger.info("Cards: fan pile =  %d", self.fan_pile)
 
     def _set_cell_size(self, w, h):
         self.card_size = (w, h)
@@ -73,11 +98,56 @@ class BaseGame(object):
     def position_pile(self, pile): 
         pile.x = self.x0 + pile.col*(self.card_size[0]+self.padding[0])
         pile.y = self.y0 - (pile.row+1)*(self.card_size[1]+self.padding[1])
-        Logger.debug("Cards: position pile %s @ %dx%d" % (pile, pile.x, pile.y))
+        Logger.debug("Cards: position pile %s @ %dx%d", pile, pile.x, pile.y)
         pile.xstep = self.fan_pile if pile.fan == 'right' else 0
         pile.ystep = self.fan_pile if pile.fan == 'down' else 0
         pile.csize = self.card_size
 
+    # spatial index of piles by layout cell - fanned piles are in every cell they can
+    # grow into. Cells don't depend on the window size so this is only built once.
+    def build_grid(self):
+        self.grid = {}
+        rows = int(math.ceil(self.num_rows))
+        for pile in self.all_piles():
+            if pile.fan == 'down':
+                cells = [(pile.col, row) for row in range(pile.row, rows)]
+            elif pile.fan == 'right':
+                cells = [(col, pile.row) for col in range(pile.col, self.num_cols)]
+            else:
+                cells = [(pile.col, pile.row)]
+            for cell in cells:
+                self.grid.setdefault(cell, []).append(pile)
+
+    # layout cell under screen point, clipped to the grid
+    def cell_at(self, x, y):
+        col = int((x - self.x0) // (self.card_size[0]+self.padding[0]))
+        row = int((self.y0 - y) // (self.card_size[1]+self.padding[1]))
+        return (min(max(col, 0), self.num_cols-1),
+                min(max(row, 0), int(math.ceil(self.num_rows))-1))
+
+    # piles that the cards being dragged from pile overlap, biggest overlap first
+    def drop_targets(self, pile):
+        if self.grid is None: self.build_grid()
+        group = pile.top()
+        col0, row0 = self.cell_at(group.x, group.top)
+        col1, row1 = self.cell_at(group.right, group.y)
+        found = []
+        for col in range(col0, col1+1):
+            for row in range(row0, row1+1):
+                for dest in self.grid.get((col, row), []):
+                    if dest is pile or dest in found: continue
+                    found.append(dest)
+        ranked = []
+        for dest in found:
+            if dest.ystep > 0 and dest.size() > 0:
+                target = dest.top()
+            else:
+                target = dest.base()
+            area = overlap(group, target)
+            if area > 0: ranked.append((area, dest))
+        ranked.sort(key=lambda item: item[0], reverse=True)
+        return [dest for _, dest in ranked]
+
     # accessors
     def tableau(self): return self.piles['tableau']
 
@@ -87,9 +157,27 @@ class BaseGame(object):
 
     def all_piles(self): return self.piles['tableau']+self.piles['foundation']+self.piles['waste']
 
-    # abstract methods
-    def can_add(self, src, pile, group, num):
-        raise NotImplementedError("can_add must be implemented")
+    def pile(self, pid): return self.piles[pid[0]][pid[1]]
+
+    # piles which are dealt to at the start of a game, in order
+    def deal_order(self): return self.board.pids('tableau')+self.board.pids('waste')
+
+    def finished(self): return self.board.count('foundation') == self.max_score
+
+    # can we add num cards from top of src pile onto dst? Checked against the
+    # compiled rules - games with rules which don't fit a Rule can override this
+    def can_add(self, src, dst, num):
+        rule = self.compiled.get(dst)
+        if rule is None: return False
+        empty, table, group = rule
+        if group is not None and num > group: return False
+        piles = self.board.piles
+        cards = piles[src]
+        if not 0 < num <= len(cards): return False
+        card = cards[-num] & CARD_MASK
+        dest = piles[dst]
+        if not dest: return bool(empty[card])
+        return bool(table[(dest[-1] & CARD_MASK) << 6 | card])
 
     def can_join(self, pile, card):
         return True
@@ -97,49 +185,99 @@ class BaseGame(object):
     def on_moved(self, move):
         pass
 
-    # add a new pile 
-    def add_pile(self, pile):
-        pile.index = len(self.piles[pile.type])
-        pile.on_release = lambda auto=False: self.on_release(pile, auto)
-        self.piles[pile.type].append(pile)
-
-    # can we move num cards from orig to dest?
-    def try_move(self, orig, dest, num, callback=False, collide=False):
-        if dest is orig: return False
-        Logger.debug("Cards: try_move %d from %r to %r" % (num, orig.pid(), dest.pid()))
-        group = orig.top()
-        if collide:
-            if dest.ystep > 0 and dest.size() > 0:
-                target = dest.top()
-            else:
-                target = dest.base()
-            if not group.collide_widget(target):
-                return False
-        if self.can_add(orig, dest, group, num):
-            # split flag is set if a new card was *not* uncovered
-            is_split = group.cards() > num
-            if not is_split and orig.size() > 1:
-                if orig.next().top_card().faceup:
-                    is_split = True
-            self.move(orig, dest, num, split=is_split, callback=callback)
+    # extra moves which don't go through can_add, e.g. dealing from a stock pile
+    def deal_moves(self):
+        return []
+
+    # sizes of group which can be picked up from top of pile
+    def group_sizes(self, src):
+        cards = self.board.cards(src)
+        n = 0
+        while n < len(cards) and cards[-n-1] & FACEUP: n += 1
+        if src[0] != 'tableau': n = min(n, 1)
+        return range(1, n+1)
+
+    # legal moves as (src, dst, num, flip) tuples - the group sizes which can move
+    # between each pair of piles are cached on the board until either pile changes
+    def legal_moves(self):
+        board = self.board
+        cache = board.moves
+        pids = board.order
+        for src in pids:
+            sizes = None
+            for dst in pids:
+                if dst == src: continue
+                nums = cache.get((src, dst))
+                if nums is None:
+                    if sizes is None: sizes = self.group_sizes(src)
+                    nums = tuple(num for num in sizes if self.can_add(src, dst, num))
+                    cache[src, dst] = nums
+                for num in nums:
+                    yield (src, dst, num, False)
+        for move in self.deal_moves():
+            yield move
+
+    # make a move from legal_moves
+    def play(self, move, callback=None):
+        src, dst, num, flip = move
+        if flip:
+            self.move(src, dst, num, flip=True, callback=callback)
+        else:
+            self.move(src, dst, num, split=self.board.is_split(src, num), callback=callback)
+
+    # add a new pile - widgets are only created if we have a layout to draw on
+    def add_pile(self, kind, col, row, **kwargs):
+        pid = (kind, len(self.board.pids(kind)))
+        self.board.add_pile(pid, kwargs.get('suit'))
+        if kind in self.rules:
+            self.compiled[pid] = self.rules[kind].compile(kwargs.get('suit'))
+        if self.layout is not None:
+            from pile import PILE_TYPES
+            pile = PILE_TYPES[kind](self, col, row, **kwargs)
+            pile.index = pid[1]
+            pile.on_release = lambda auto=False: self.on_release(pile, auto)
+            self.piles[kind].append(pile)
+        return pid
+
+    # put a card from the deck on top of a pile
+    def deal(self, pid, card):
+        self.board.add(pid, card.code())
+        if self.layout is not None:
+            self.pile(pid).add_card(card)
+
+    # can we move num cards from src to dst pile?
+    def try_move(self, src, dst, num, callback=False):
+        if dst == src: return False
+        Logger.debug("Cards: try_move %d from %r to %r", num, src, dst)
+        if self.board.movable(src, num) and self.can_add(src, dst, num):
+            is_split = self.board.is_split(src, num)
+            self.move(src, dst, num, split=is_split, callback=callback)
             return True
         return False
 
+    # apply a move immediately - used when running headless with no app
+    def move_now(self, src, dst, num, callback=None, **args):
+        args['src'], args['dst'], args['n'] = src, dst, num
+        self.do_move(args)
+        self.on_moved(args)
+        if callback: callback()
+
     # callback on card drag released - returns cards moved or None if no move
     def on_release(self, pile, auto=False):
-        Logger.debug("Cards: on_release %s %d auto=%s" % (pile.type, pile.index, auto))
+        Logger.debug("Cards: on_release %s %d auto=%s", pile.type, pile.index, auto)
         top = pile.top()
         if top.cards() == 0 or top.top_card() is None: return False
         #Logger.debug("Cards: %d cards released top=%s bot=%s" % 
         #             (top.cards(), top.top_card(), top.bottom_card()))
         # build on foundation or tableau?
+        board = self.board
         if auto:
-            for dest in self.foundation():
-                if self.try_move(pile, dest, top.cards(), collide=False):
+            for dest in board.pids('foundation'):
+                if self.try_move(pile.pid(), dest, top.cards()):
                     return top
         else:
-            for dest in self.foundation() + self.tableau() + self.waste():
-                if self.try_move(pile, dest, top.cards(), collide=True):
+            for dest in self.drop_targets(pile):
+                if self.try_move(pile.pid(), dest.pid(), top.cards()):
                     return top
         Logger.debug("Cards: move back")
         pile.move_cards_back()
@@ -147,15 +285,17 @@ class BaseGame(object):
    
     # check for any cards which can be moved to foundations
     def auto_drop(self):
-        for orig in self.tableau() + self.waste():
-            if orig.size() > 0 and orig.top().top_card().faceup:
-                for dest in self.foundation():
-                    if self.try_move(orig, dest, 1, callback=self.auto_drop):
-                        return True
+        for move in self.legal_moves():
+            src, dst, num, flip = move
+            if dst[0] == 'foundation' and src[0] != 'foundation' and not flip:
+                self.play(move, callback=self.auto_drop)
+                return True
         return False
 
-    # execute a move, returns affected piles and change in score
-    def do_move(self, move, reverse=False):
+    # execute a move, returns ids of affected piles and change in score
+    # with draw off only the board is updated and the caller must sync the piles
+    @timed('do_move')
+    def do_move(self, move, reverse=False, draw=True):
         src, dst, num = move['src'], move['dst'], move['n']
         if reverse:
             move['src'], move['dst'] = dst, src
@@ -169,19 +309,22 @@ class BaseGame(object):
         if move['dst'][0] == 'foundation': score = num
         if move['src'][0] == 'foundation': score = -num
         # move from src to dst
-        Logger.debug("Cards: do_move %r" % move)
+        Logger.debug("Cards: do_move %r", move)
         src, dst = move['src'], move['dst']
-        orig = self.piles[src[0]][src[1]]
-        dest = self.piles[dst[0]][dst[1]]
-        orig.move_num_cards_to(dest, num, 'expose' in move, 'cover' in move, 'flip' in move)
-        # any items we exposed should now be movable
-        if orig.size() > 0 and orig.top().top_card() and orig.top().top_card().faceup:
-            orig.top().lock(False)
-        return orig, dest, score
+        flags = 'expose' in move, 'cover' in move, 'flip' in move
+        self.board.move(src, dst, num, *flags)
+        # then update the view to match
+        if draw and self.layout is not None:
+            orig, dest = self.pile(src), self.pile(dst)
+            orig.move_num_cards_to(dest, num, *flags)
+            # any items we exposed should now be movable
+            if orig.size() > 0 and orig.top().top_card() and orig.top().top_card().faceup:
+                orig.top().lock(False)
+        return src, dst, score
 
     # deal top card from src to each of dest list of piles
     def deal_cards(self, src, dest, append=False):
-        if src.size() > 0 and len(dest) > 0:
+        if self.board.size(src) > 0 and len(dest) > 0:
             cb = partial(self.deal_cards, src, dest[1:], True)
             self.move(src, dest[0], 1, flip=True, append=append, callback=cb)
 
@@ -0,0 +1,314 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+
+os.environ['KIVY_NO_ARGS'] = '1'
+
+from cards import Deck, FACEUP, encode
+from journal import Journal
+from history import History
+from snapshot import Snapshot
+
+# benchmarks for the game rules, dealing and saving, run against the headless
+# board model so they need no window. Timing follows pytest-benchmark - each
+# round runs the function enough times to take min_time, or once after a fresh
+# setup if it changes the state - and results are written in the same JSON form
+# so runs from different releases can be compared:
+#   python benchmark.py --json before.json
+#   python benchmark.py --compare before.json
+# --ui adds benchmarks which need card widgets, such as relayout on resize.
+
+GAMES = ('Klondike', 'Yukon')
+HISTORY_SIZES = (0, 100, 1000)
+WINDOW_SIZES = [(800, 600), (1280, 720), (600, 900), (1920, 1080)]
+
+
+class Benchmark(object):
+
+    def __init__(self, name, group, fn, setup=None, **params):
+        self.name = name
+        self.group = group
+        self.fn = fn
+        self.setup = setup
+        self.params = params
+        self.extra_info = {}
+
+    # time of one call and of one round of iterations calls
+    def run_round(self, iterations):
+        args = self.setup() if self.setup else ()
+        start = time.perf_counter()
+        for _ in range(iterations):
+            self.fn(*args)
+        return (time.perf_counter() - start) / iterations
+
+    # find iterations so a round takes at least min_time - setup means once per round
+    def calibrate(self, min_time):
+        if self.setup: return 1
+        iterations = 1
+        while True:
+            if self.run_round(iterations)*iterations >= min_time or iterations >= 1 << 20:
+                return iterations
+            iterations *= 10
+
+    def run(self, rounds, min_time, max_time):
+        iterations = self.calibrate(min_time)
+        self.run_round(iterations)
+        data = []
+        stop = time.perf_counter() + max_time
+        while len(data) < rounds and (len(data) < 3 or time.perf_counter() < stop):
+            data.append(self.run_round(iterations))
+        return self.result(data, iterations)
+
+    def result(self, data, iterations):
+        data = sorted(data)
+        q1, _, q3 = statistics.quantiles(data, n=4) if len(data) > 1 else (data[0],)*3
+        mean = statistics.mean(data)
+        stats = dict(min=data[0], max=data[-1], mean=mean,
+                     stddev=statistics.stdev(data) if len(data) > 1 else 0,
+                     median=statistics.median(data), q1=q1, q3=q3, iqr=q3-q1,
+                     rounds=len(data), iterations=iterations, ops=1/mean if mean else 0)
+        return dict(name=self.name, fullname=self.name, group=self.group,
+                    params=self.params, extra_info=self.extra_info, stats=stats)
+
+
+# game with its first deal, running headless
+def new_game(name, seed=1):
+    import games
+    game = getattr(games, name)()
+    game.build()
+    deck = Deck(game.decks)
+    deck.rewind(shuffle=True, seed=seed)
+    deal(game, deck)
+    return game, deck
+
+def deal(game, deck):
+    game.board.clear(1)
+    deck.rewind()
+    for pid in game.deal_order():
+        game.start(pid, deck)
+
+# every (src, dst, num) the rules could be asked about on the current board
+def can_add_calls(game):
+    board = game.board
+    return [(src, dst, num) for src in board.order for dst in board.order if dst != src
+            for num in range(1, board.size(src)+1) if board.movable(src, num)]
+
+# all cards face up in four tableau piles, king at the bottom and ace on top,
+# so a single auto drop moves the whole pack to the foundations
+def stacked(game):
+    board = game.board
+    board.clear(1)
+    for pid, suit in zip(board.pids('tableau'), Deck.suits):
+        board.set(pid, (encode(rank, suit) | FACEUP for rank in range(Deck.king, Deck.ace-1, -1)))
+    return board.copy()
+
+# random legal play recorded in the history - the deal is replayed the same way each time
+def play(game, history, count, seed=1):
+    def record(src, dst, num, callback=None, **args):
+        args['src'], args['dst'], args['n'] = src, dst, num
+        if args.get('append'): history.append(args)
+        else: history.push(args)
+        game.do_move(args)
+        game.on_moved(args)
+    game.move = record
+    rand = random.Random(seed)
+    for _ in range(count):
+        moves = list(game.legal_moves())
+        if not moves: break
+        game.play(rand.choice(moves))
+    game.move = game.move_now
+
+def undo_all(game, history):
+    while history.can_undo():
+        for move in history.undo():
+            game.do_move(move, reverse=True)
+
+
+def rules_benchmarks(name):
+    game, deck = new_game(name)
+    benches = [Benchmark('deal[%s]' % name, 'deal', lambda: deal(game, deck), game=name)]
+
+    calls = can_add_calls(game)
+    def can_add():
+        for src, dst, num in calls: game.can_add(src, dst, num)
+    bench = Benchmark('can_add[%s]' % name, 'rules', can_add, game=name)
+    bench.extra_info['calls'] = len(calls)
+    benches.append(bench)
+
+    def legal_moves_cold():
+        game.board.moves.clear()
+        return list(game.legal_moves())
+    benches.append(Benchmark('legal_moves_cold[%s]' % name, 'rules', legal_moves_cold, game=name))
+    benches.append(Benchmark('legal_moves_cached[%s]' % name, 'rules',
+                             lambda: list(game.legal_moves()), game=name))
+
+    # try each legal move on the deal and take it back again
+    moves = [move for move in game.legal_moves() if not move[3]]
+    made = []
+    def record(src, dst, num, callback=None, **args):
+        args['src'], args['dst'], args['n'] = src, dst, num
+        made.append(args)
+        game.do_move(args)
+        game.on_moved(args)
+    def cycle():
+        game.move = record
+        for src, dst, num, flip in moves:
+            game.try_move(src, dst, num)
+            while made: game.do_move(made.pop(), reverse=True)
+        game.move = game.move_now
+    bench = Benchmark('move_cycle[%s]' % name, 'moves', cycle, game=name)
+    bench.extra_info['moves'] = len(moves)
+    benches.append(bench)
+
+    drop = new_game(name)[0]
+    chain = stacked(drop)
+    def setup_chain():
+        drop.board = chain.copy()
+        return ()
+    benches.append(Benchmark('auto_drop[%s]' % name, 'moves', drop.auto_drop, setup_chain,
+                             game=name, cards=52))
+    return benches
+
+def undo_benchmarks(name, sizes, tmp):
+    benches = []
+    for size in sizes:
+        game, deck = new_game(name)
+        history = History(Journal(os.path.join(tmp, 'undo.moves')))
+        play(game, history, size)
+        board, count = game.board.copy(), history.count
+        def setup(game=game, history=history, board=board, count=count):
+            game.board = board.copy()
+            history.count = count
+            return (game, history)
+        benches.append(Benchmark('undo[%s-%d]' % (name, size), 'undo', undo_all, setup,
+                                 game=name, moves=count))
+    return benches
+
+# saving and loading a game - snapshot plus the move journal, at different lengths
+# of history. Saving the whole journal is the worst case, after it has been compacted.
+def persistence_benchmarks(name, sizes, tmp):
+    benches = []
+    for size in sizes:
+        game, deck = new_game(name)
+        path = os.path.join(tmp, '%s-%d' % (name, size))
+        history = History(Journal(path + '.moves'))
+        play(game, history, size)
+        board = game.board
+        snap = Snapshot(name, deck.seed, deck.d.tobytes(), 0, history.count, len(history),
+                        0, False, [(pid, board.cards(pid)) for pid in board.order])
+        def save(snap=snap, path=path, history=history):
+            snap.write(path + '.snap')
+            journal = history.journal
+            journal.reset()
+            for index in range(len(history)): history.log(index)
+            journal.flush()
+        def restore(path=path, board=board):
+            snap = Snapshot.read(path + '.snap')
+            for pid, cards in snap.piles: board.set(pid, cards)
+            history = History(Journal(path + '.moves'))
+            history.load(snap.moves, snap.max_moves)
+            return history
+        save()
+        benches += [Benchmark('save[%s-%d]' % (name, size), 'persistence', save,
+                              game=name, moves=len(history)),
+                    Benchmark('restore[%s-%d]' % (name, size), 'persistence', restore,
+                              game=name, moves=len(history))]
+    return benches
+
+# card widgets laid out for each window size in turn - needs a kivy window
+def resize_benchmarks(name):
+    from kivy.uix.floatlayout import FloatLayout
+    import cardatlas
+    import games
+    class Root(object):
+        layout = FloatLayout()
+    thread = cardatlas.build_later()
+    if thread: thread.join()
+    cardatlas.load()
+    game = getattr(games, name)(root=Root())
+    game.build()
+    deck = Deck(game.decks)
+    deck.rewind(shuffle=True, seed=1)
+    for pid in game.deal_order():
+        game.start(pid, deck)
+    def resize():
+        for size in WINDOW_SIZES: game.do_resize(size)
+    bench = Benchmark('resize[%s]' % name, 'resize', resize, game=name)
+    bench.extra_info['sizes'] = len(WINDOW_SIZES)
+    return [bench]
+
+
+def machine_info():
+    import kivy
+    return dict(node=platform.node(), machine=platform.machine(), system=platform.system(),
+                release=platform.release(), python_version=platform.python_version(),
+                python_implementation=platform.python_implementation(),
+                kivy_version=kivy.__version__)
+
+# print change in mean time against an earlier run, returns names which got slower
+def compare(results, path, threshold):
+    with open(path) as f:
+        before = dict((b['name'], b['stats']) for b in json.load(f)['benchmarks'])
+    slower = []
+    for bench in results:
+        old = before.get(bench['name'])
+        if old is None: continue
+        change = bench['stats']['mean'] / old['mean'] - 1
+        print("%-32s %+7.1f%%" % (bench['name'], 100*change))
+        if change > threshold: slower.append(bench['name'])
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the solitaire rules and persistence')
+    parser.add_argument('--game', action='append', choices=GAMES)
+    parser.add_argument('-k', dest='select', default='', help='only names containing this')
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--min-time', type=float, default=0.005, help='seconds per round')
+    parser.add_argument('--max-time', type=float, default=2.0, help='seconds per benchmark')
+    parser.add_argument('--history', type=int, nargs='+', default=HISTORY_SIZES)
+    parser.add_argument('--ui', action='store_true', help='include benchmarks which need a window')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', help='earlier --json results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='fraction slower which fails the comparison')
+    args = parser.parse_args()
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    tmp = tempfile.mkdtemp(prefix='solitaire-bench')
+    try:
+        benches = []
+        for name in args.game or GAMES:
+            benches += rules_benchmarks(name)
+            benches += undo_benchmarks(name, args.history, tmp)
+            benches += persistence_benchmarks(name, args.history, tmp)
+            if args.ui: benches += resize_benchmarks(name)
+        results = []
+        for bench in benches:
+            if args.select not in bench.name: continue
+            result = bench.run(args.rounds, args.min_time, args.max_time)
+            stats = result['stats']
+            print("%-32s %10.1fus  +- %6.1fus  %5d rounds" % (
+                  bench.name, 1e6*stats['mean'], 1e6*stats['stddev'], stats['rounds']))
+            results.append(result)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(dict(machine_info=machine_info(), datetime=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                           version='1.0', benchmarks=results), f, indent=2)
+    if args.compare:
+        slower = compare(results, args.compare, args.threshold)
+        if slower:
+            print("slower than %s: %s" % (args.compare, ', '.join(slower)))
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
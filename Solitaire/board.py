@@ -0,0 +1,131 @@
+from cards import RANK, SUIT, FACEUP, encode, next_rank
+
+# headless game state - no kivy imports allowed in this module
+# a card is an int code from cards.encode and a pile is a bytearray of codes, bottom first
+# piles are keyed by pid, a (type, index) tuple as used in the move history
+
+
+# convert from the config file format of Card.export, used by older saves
+def import_card(data):
+    return encode(data[0], data[1], len(data) > 2 and data[2])
+
+
+class Board(object):
+
+    def __init__(self):
+        self.piles = {}
+        self.suits = {}
+        self.order = []
+        # legal move cache for the game rules - (src, dst) -> group sizes which
+        # can move, dropped whenever either pile changes
+        self.moves = {}
+        self.pairs = {}
+
+    def add_pile(self, pid, suit=None):
+        self.piles[pid] = bytearray()
+        self.suits[pid] = suit or None
+        self.order.append(pid)
+        self.pairs[pid] = []
+        for other in self.order[:-1]:
+            self.pairs[pid] += [(pid, other), (other, pid)]
+            self.pairs[other] += [(other, pid), (pid, other)]
+
+    # accessors
+    def pids(self, kind=None):
+        if kind is None: return list(self.order)
+        return [pid for pid in self.order if pid[0] == kind]
+
+    def cards(self, pid): return self.piles[pid]
+
+    def size(self, pid): return len(self.piles[pid])
+
+    def suit(self, pid): return self.suits[pid]
+
+    def top(self, pid):
+        cards = self.piles[pid]
+        return cards[-1] if cards else None
+
+    # nth card down from top of pile, i.e. base of a group of n cards
+    def card(self, pid, n=1):
+        cards = self.piles[pid]
+        return cards[-n] if 0 < n <= len(cards) else None
+
+    def count(self, kind):
+        return sum(len(self.piles[pid]) for pid in self.order if pid[0] == kind)
+
+    # empty all piles, or remove them if base is 0
+    def clear(self, base=1):
+        if base == 0:
+            self.__init__()
+        else:
+            for cards in self.piles.values(): del cards[:]
+            self.moves.clear()
+
+    def add(self, pid, card):
+        self.piles[pid].append(card)
+        self.changed(pid)
+
+    # forget cached moves to or from pile
+    def changed(self, pid):
+        moves = self.moves
+        if not moves: return
+        for key in self.pairs[pid]:
+            moves.pop(key, None)
+
+    # are the top n cards face up, so they can be picked up together?
+    def movable(self, pid, num):
+        cards = self.piles[pid]
+        if num < 1 or num > len(cards): return False
+        return all(card & FACEUP for card in cards[-num:])
+
+    # split flag is set if a new card would *not* be uncovered by moving num cards
+    def is_split(self, pid, num):
+        cards = self.piles[pid]
+        return len(cards) > num and bool(cards[-num-1] & FACEUP)
+
+    # move num cards - flipped cards are dealt one at a time so reverse order
+    def move(self, src, dst, num, expose=False, cover=False, flip=False):
+        orig, dest = self.piles[src], self.piles[dst]
+        cards = orig[len(orig)-num:]
+        del orig[len(orig)-num:]
+        if flip:
+            cards = bytearray(card ^ FACEUP for card in reversed(cards))
+        if expose and orig:
+            orig[-1] |= FACEUP
+        if cover and dest:
+            dest[-1] &= ~FACEUP
+        dest += cards
+        self.changed(src)
+        self.changed(dst)
+        return len(cards)
+
+    # build rules
+    def by_rank(self, pid, card, base=None, order=1, suit=None, wrap=False):
+        if suit is not None and SUIT[card] != suit:
+            return False
+        top = self.top(pid)
+        if top is None:
+            return base is None or RANK[card] == base
+        return RANK[card] == next_rank(RANK[top], order, wrap)
+
+    # persistence
+    def load(self, pid, data):
+        self.set(pid, (import_card(c) for c in data))
+
+    # replace pile with card codes, e.g. from a snapshot
+    def set(self, pid, cards):
+        self.piles[pid] = bytearray(cards)
+        self.changed(pid)
+
+    # hashable position and independent copy for simulation
+    def key(self):
+        return tuple(bytes(self.piles[pid]) for pid in self.order)
+
+    def copy(self):
+        board = Board.__new__(Board)
+        board.piles = dict((pid, bytearray(cards)) for pid, cards in self.piles.items())
+        board.suits = self.suits
+        board.order = self.order
+        board.pairs = self.pairs
+        board.moves = dict(self.moves)
+        return board
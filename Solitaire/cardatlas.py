@@ -0,0 +1,57 @@
+import os
+import glob
+import threading
+
+from kivy.logger import Logger
+
+import cards
+
+# pack all the card faces, back and pile bases into one kivy atlas so a board is
+# drawn from a single texture. Built in the background on first run (needs PIL)
+# and used from the next one, or ahead of time with: python cardatlas.py
+ATLAS = 'images/cards'
+# room for 8x8 cards of 226x314 plus padding, so everything is on one page
+ATLAS_SIZE = (2048, 2560)
+
+def sources():
+    return sorted(name for name in glob.glob('images/*.png')
+                  if not os.path.basename(name).startswith('cards-'))
+
+# is the atlas missing or older than any of the images?
+def stale():
+    path = ATLAS + '.atlas'
+    if not os.path.exists(path): return True
+    built = os.path.getmtime(path)
+    return any(os.path.getmtime(name) > built for name in sources())
+
+def build():
+    # check for PIL here so it fails quietly rather than as a critical error from kivy
+    from PIL import Image
+    from kivy.atlas import Atlas
+    images = sources()
+    Logger.info("Cards: packing %d images into %s.atlas", len(images), ATLAS)
+    Atlas.create(ATLAS, images, ATLAS_SIZE)
+
+# switch card images over to the atlas if it is up to date - packing takes too long
+# to wait for at startup, so until then the separate files are used
+def load():
+    if stale(): return False
+    cards.use_atlas('atlas://' + ATLAS + '/')
+    return True
+
+# pack the atlas on a thread for the next run, returns the thread or None if there
+# is nothing to do. Not a daemon, so quitting doesn't leave a half written atlas
+def build_later():
+    if not stale(): return None
+    thread = threading.Thread(target=try_build, name='atlas')
+    thread.start()
+    return thread
+
+def try_build():
+    try:
+        build()
+    except Exception as e:
+        Logger.warning("Cards: texture atlas not available - %s", e)
+
+if __name__ == '__main__':
+    build()
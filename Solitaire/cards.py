@@ -1,44 +1,116 @@
 import random
 import ast
+from array import array
+
+# compact card encoding - a card is a small int with the rank in the low 4 bits,
+# suit index in the next 2 bits and a face up flag above, so a deck or pile of
+# cards fits in a byte array. Lookup tables are indexed by the card code.
+SUITS = ['c', 's', 'h', 'd']
+SUIT_SHIFT = 4
+FACEUP = 0x40
+NUM_CODES = 0x80
+
+def encode(rank, suit, faceup=False):
+    return rank | SUITS.index(suit) << SUIT_SHIFT | (FACEUP if faceup else 0)
+
+def next_rank(rank, order, wrap):
+    next = rank + order
+    if wrap:
+        if next > Deck.king: next = Deck.ace
+        if next < Deck.ace: next = Deck.king
+    return next
+
+RANK = bytes(code & 0x0f for code in range(NUM_CODES))
+SUIT = [SUITS[code >> SUIT_SHIFT & 3] for code in range(NUM_CODES)]
+COLOR = [1 if s == 'c' or s == 's' else -1 for s in SUIT]
+IMAGE = ["images/%d%s.png" % (RANK[code], SUIT[code]) for code in range(NUM_CODES)]
+BACK_IMAGE = 'images/back.png'
+BASE_IMAGE = 'images/bot%s.png'
+
+# take images from a texture atlas, ids are the image file names
+def use_atlas(prefix):
+    global BACK_IMAGE, BASE_IMAGE
+    for code in range(NUM_CODES):
+        IMAGE[code] = "%s%d%s" % (prefix, RANK[code], SUIT[code])
+    BACK_IMAGE = prefix + 'back'
+    BASE_IMAGE = prefix + 'bot%s'
+
+# stable shuffle so a seed gives the same deal on every platform and version:
+# Fisher-Yates from the top of the array, where each swap index is the high 32 bits
+# of the next state of the 64 bit MMIX linear congruential generator modulo i+1
+MASK64 = (1 << 64) - 1
+
+def shuffle_cards(cards, seed):
+    state = seed & MASK64
+    for i in range(len(cards)-1, 0, -1):
+        state = (state*6364136223846793005 + 1442695040888963407) & MASK64
+        j = (state >> 32) % (i+1)
+        cards[i], cards[j] = cards[j], cards[i]
+
+# deal id is the 32 bit seed in base 36
+DEAL_ID_CHARS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+MAX_SEED = 1 << 32
+
+def deal_id(seed):
+    if seed is None: return ''
+    text = ''
+    while True:
+        seed, digit = divmod(seed, 36)
+        text = DEAL_ID_CHARS[digit] + text
+        if seed == 0: return text
+
+def parse_deal_id(text):
+    seed = int(text.strip(), 36)
+    if not 0 <= seed < MAX_SEED:
+        raise ValueError("deal id out of range: %s" % text)
+    return seed
+
+
 class Card(object):
+    __slots__ = ('rank', 'suit', 'faceup', 'index')
     aspect_ratio = 314.0/226.0
 
     def __init__(self, rank, suit, faceup=False):
         self.rank = rank
         self.suit = suit
         self.faceup = faceup
-   
+        self.index = encode(rank, suit)
+
     def __str__(self):
         return "%d%s faceup=%s" % (self.rank,self.suit,self.faceup)
 
     def image(self):
         if self.faceup:
-            return "images/%d%s.png" % (self.rank,self.suit)
+            return IMAGE[self.index]
         else:
-            return 'images/back.png'
+            return BACK_IMAGE
 
     def color(self):
-        if self.suit == 'c' or self.suit == 's': return 1
-        return -1
+        return COLOR[self.index]
 
     def next_rank(self, order, wrap):
-        next = self.rank + order
-        if wrap:
-            if next > Deck.king: next = Deck.ace
-            if next < Deck.ace: next = Deck.king
-        return next
+        return next_rank(self.rank, order, wrap)
+
+    # compact form used by the board model
+    def code(self):
+        return self.index | FACEUP if self.faceup else self.index
+
+    @staticmethod
+    def decode(code):
+        return Card(RANK[code], SUIT[code], bool(code & FACEUP))
 
     def export(self):
         return (self.rank,self.suit,True) if self.faceup else (self.rank,self.suit)
 
     @staticmethod
     def base_image(suit=''):
-        return "images/bot%s.png" % suit
+        return BASE_IMAGE % suit
 
 
 # deck is list of decks*52 cards - object with option to persist data
+# cards are stored face down as codes in a byte array
 class Deck(object):
-    suits = ['c', 's', 'h', 'd']
+    suits = SUITS
     ace = 1
     jack = 11
     queen = 12
@@ -47,31 +119,48 @@ class Deck(object):
     def __init__(self, decks, config=None):
         self.i = 0
         self.decks = decks
+        self.seed = None
         if config is None:
-            self.d = [Card(r,s) for _ in range(decks) for s in self.suits for r in range(1,14)]
+            self.d = self.ordered()
         else:
             self.load(config)
- 
-    def rewind(self, shuffle=False):
+
+    def ordered(self):
+        return array('B', [encode(r,s) for _ in range(self.decks) for s in self.suits for r in range(1,14)])
+
+    # new shuffle is dealt from the seed, or a random one if not given
+    def rewind(self, shuffle=False, seed=None):
         self.i = 0
-        for card in self.d: card.faceup = False
-        if shuffle: random.shuffle(self.d)
+        if shuffle:
+            self.seed = seed if seed is not None else random.randrange(MAX_SEED)
+            self.d = self.ordered()
+            shuffle_cards(self.d, self.seed)
 
     def get(self, index):
-        return self.d[index]
+        return Card.decode(self.d[index])
 
-    def next(self, faceup=False):
-        card = self.d[self.i]
-        card.faceup = faceup
+    def next_code(self, faceup=False):
+        code = self.d[self.i]
         self.i += 1
-        return card
+        return code | FACEUP if faceup else code
 
-    def load(self, config):
-        cards = ast.literal_eval(config.get('game', 'deck'))
-        self.d = [Card(*c) for c in cards]
+    def next(self, faceup=False):
+        return Card.decode(self.next_code(faceup))
 
-    def save(self, config):
-        cards = [card.export() for card in self.d]
-        config.set('game', 'deck', cards)
+    # card order as read back from a snapshot
+    def restore(self, seed, cards):
+        self.i = 0
+        self.seed = seed
+        self.d = array('B', cards)
 
+    # game saved in the config file by older versions - the seed, or before that the list of cards
+    @staticmethod
+    def saved(config):
+        return config.has_option('game', 'seed') or config.has_option('game', 'deck')
 
+    def load(self, config):
+        if config.has_option('game', 'seed'):
+            self.rewind(shuffle=True, seed=config.getint('game', 'seed'))
+        else:
+            cards = ast.literal_eval(config.get('game', 'deck'))
+            self.d = array('B', [encode(c[0], c[1]) for c in cards])
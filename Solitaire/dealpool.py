@@ -0,0 +1,108 @@
+import os
+import json
+import random
+import signal
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+from kivy.logger import Logger
+
+from cards import Deck
+from solver import Solver, SOLVED
+
+# run in worker process - look for a seed which the solver can win
+def find_deal(game_class, max_nodes, tries):
+    rng = random.SystemRandom()
+    solver = Solver(game_class, max_nodes=max_nodes)
+    deck = Deck(game_class.decks)
+    for _ in range(tries):
+        seed = rng.getrandbits(32)
+        deck.rewind(shuffle=True, seed=seed)
+        status, _ = solver.solve(solver.deal(deck))
+        if status == SOLVED:
+            return seed
+    return None
+
+# forked workers inherit the SDL signal handlers - restore default so terminate works
+def init_worker():
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+# fork where we can so workers don't re-import the app, else fall back to threads
+def new_workers(workers):
+    try:
+        return multiprocessing.get_context('fork').Pool(workers, initializer=init_worker)
+    except (ValueError, ImportError, OSError, NotImplementedError):
+        return ThreadPool(workers)
+
+
+# pool of verified winnable seeds for each game, saved as json - seeds from
+# another version of the shuffle would not be the deals that were verified
+class DealPool(object):
+    version = 1
+    size = 10
+    num_workers = 1
+    max_nodes = 5000
+    tries = 50
+
+    def __init__(self, path):
+        self.path = path
+        self.seeds = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.workers = None
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+                if data.get('version') == self.version:
+                    self.seeds = data['seeds']
+            except (ValueError, KeyError, AttributeError):
+                Logger.warning("Cards: ignoring corrupt deal pool %s", path)
+
+    # next winnable seed for game, or None if the pool is empty
+    def take(self, game_class):
+        with self.lock:
+            seeds = self.seeds.get(game_class.name, [])
+            seed = seeds.pop(0) if seeds else None
+        if seed is not None:
+            self.save()
+        self.fill(game_class)
+        return seed
+
+    # queue background searches to top up the pool
+    def fill(self, game_class):
+        name = game_class.name
+        with self.lock:
+            missing = self.size - len(self.seeds.get(name, [])) - self.pending.get(name, 0)
+            if missing <= 0: return
+            self.pending[name] = self.pending.get(name, 0) + missing
+        if self.workers is None:
+            self.workers = new_workers(self.num_workers)
+        Logger.info("Cards: searching for %d %s deals", missing, name)
+        for _ in range(missing):
+            self.workers.apply_async(find_deal, (game_class, self.max_nodes, self.tries),
+                    callback=lambda seed, name=name: self.found(name, seed),
+                    error_callback=lambda err, name=name: self.found(name, None))
+
+    # callback from worker - runs on pool result thread
+    def found(self, name, seed):
+        with self.lock:
+            self.pending[name] -= 1
+            if seed is not None:
+                self.seeds.setdefault(name, []).append(seed)
+        if seed is not None:
+            Logger.debug("Cards: found %s deal %d", name, seed)
+            self.save()
+
+    def save(self):
+        with self.lock:
+            with open(self.path, 'w') as f:
+                json.dump(dict(version=self.version, seeds=self.seeds), f)
+
+    # stop searching - unfinished work is thrown away
+    def close(self):
+        if self.workers is not None:
+            self.workers.terminate()
+            self.workers = None
@@ -0,0 +1,51 @@
+import math
+import time
+
+# time played on the current game, from a monotonic source so it doesn't drift
+# with the frame rate or jump when the wall clock changes. Stopped while the app
+# is paused and saved with the game. No kivy imports - the model runs headless.
+class GameClock(object):
+
+    def __init__(self, limit=600, now=time.monotonic):
+        self.limit = limit
+        self.now = now
+        self.paused = False
+        self.reset()
+
+    # start again from elapsed seconds, stopped
+    def reset(self, elapsed=0.0):
+        self.base = elapsed
+        self.since = None
+
+    def running(self): return self.since is not None
+
+    def start(self):
+        if self.since is None:
+            self.since = self.now()
+
+    def stop(self):
+        if self.since is not None:
+            self.base += self.now() - self.since
+            self.since = None
+
+    # stop while the app is in the background, and carry on afterwards if it was running
+    def pause(self):
+        self.paused = self.running()
+        self.stop()
+
+    def resume(self):
+        if self.paused: self.start()
+        self.paused = False
+
+    def elapsed(self):
+        if self.since is None: return self.base
+        return self.base + self.now() - self.since
+
+    def remaining(self):
+        return max(0.0, self.limit - self.elapsed())
+
+    # whole seconds left to show, and seconds until that changes
+    def display(self):
+        remaining = self.remaining()
+        shown = int(math.ceil(remaining))
+        return shown, remaining - (shown - 1)
@@ -1,8 +1,8 @@
 from functools import partial
 from kivy.logger import Logger
 from cards import Deck
-from pile import Foundation, Tableau, Waste
 from basegame import BaseGame
+from rules import Rule
 
 
 class Yukon(BaseGame):
@@ -22,30 +22,25 @@ Cards can also be moved back from the foundations.
     tableau_pos = 0
     foundation_pos = [(7,i) for i in range(4)]
     tableau_depth = [(0,1)] + [(i,5) for i in range(1,7)]
+    rules = dict(foundation=Rule(base=Deck.ace, suit=True, group=1),
+                 tableau=Rule(base=Deck.king, order=-1, color='alt'))
 
     def build(self):
         for i in range(self.num_tableau):
-             self.add_pile(Tableau(self, i, self.tableau_pos, fan='down'))
+             self.add_pile('tableau', i, self.tableau_pos, fan='down')
         for i, s in enumerate(Deck.suits):
-            self.add_pile(Foundation(self, *self.foundation_pos[i], suit=s))
+            self.add_pile('foundation', *self.foundation_pos[i], suit=s)
 
  
-    def start(self, pile, deck):
-        if pile.type == 'tableau':
-            for i in range(self.tableau_depth[pile.index][0]):
-                pile.add_card(deck.next())
-            for i in range(self.tableau_depth[pile.index][1]):
-                pile.add_card(deck.next(True))
+    def start(self, pid, deck):
+        kind, index = pid
+        if kind == 'tableau':
+            for i in range(self.tableau_depth[index][0]):
+                self.deal(pid, deck.next())
+            for i in range(self.tableau_depth[index][1]):
+                self.deal(pid, deck.next(True))
 
 
-    def can_add(self, src, pile, group, num):
-        if pile.type == 'foundation':
-  
-            return num == 1 and pile.by_rank(group.top_card(), base=Deck.ace, suit=pile.suit)
-        elif pile.type == 'tableau':
-     
-            return pile.by_alt_color(group.bottom_card(), base=Deck.king, order=-1)
-        
 class Klondike(Yukon):
     name = 'Klondike'
     help = """\
@@ -67,33 +62,45 @@ Touch the deck at top left to deal onto the waste or to redeal the pack if empty
     # setup the initial game layout
     def build(self):
         super(Klondike, self).build()
-        self.add_pile(Waste(self, 0, 0, show_count='base', on_touch=self.deal_next))
-        self.add_pile(Waste(self, 1, 0, show_count='base'))
+        self.add_pile('waste', 0, 0, show_count='base', on_touch=self.deal_next)
+        self.add_pile('waste', 1, 0, show_count='base')
 
     # deal initial cards to given pile
-    def start(self, pile, deck):
-        super(Klondike, self).start(pile, deck)
-        if pile.type == 'waste':
-            if pile.index == 0:
+    def start(self, pid, deck):
+        super(Klondike, self).start(pid, deck)
+        if pid[0] == 'waste':
+            if pid[1] == 0:
                 for _ in range(24-self.deal_by):
-                    pile.add_card(deck.next())
+                    self.deal(pid, deck.next())
             else:
                 for _ in range(self.deal_by):
-                    pile.add_card(deck.next(True))
+                    self.deal(pid, deck.next(True))
 
     # callback to deal next 3 cards
     def deal_next(self):
         Logger.debug("Cards: deal")
-        pile, waste = self.waste()
-        if pile.size() > 0:
-            self.move(pile, waste, min(self.deal_by, pile.size()), flip=True)
+        pile, waste = self.board.pids('waste')
+        size = self.board.size(pile)
+        if size > 0:
+            self.move(pile, waste, min(self.deal_by, size), flip=True)
         else:
-            num = waste.size()
-            Logger.debug("Cards: pick up %d cards from waste" % num)
+            num = self.board.size(waste)
+            Logger.debug("Cards: pick up %d cards from waste", num)
             self.move(waste, pile, num, flip=True, append=True)
 
+    # deal from the stock, or turn the waste pile over when it is empty
+    def deal_moves(self):
+        pile, waste = self.board.pids('waste')
+        size = self.board.size(pile)
+        if size > 0:
+            return [(pile, waste, min(self.deal_by, size), True)]
+        elif self.board.size(waste) > 0:
+            return [(waste, pile, self.board.size(waste), True)]
+        return []
+
     # auto-deal onto empty waste pile
     def on_moved(self, move):
-         pile, waste = self.waste()
-         if waste.size() == 0 and pile.size() > 0:
-            self.move(pile, waste, min(self.deal_by, pile.size()), flip=True, append=True, callback=None)
+         pile, waste = self.board.pids('waste')
+         size = self.board.size(pile)
+         if self.board.size(waste) == 0 and size > 0:
+            self.move(pile, waste, min(self.deal_by, size), flip=True, append=True, callback=None)
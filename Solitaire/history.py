@@ -0,0 +1,70 @@
+from ast import literal_eval
+
+# undo/redo stack of move records - an entry is the list of move dicts made by
+# one user action, including any moves appended to it such as an auto deal.
+# Entries are kept in memory and each change is written through to the journal,
+# which is only read back once on startup.
+class History(object):
+
+    def __init__(self, journal):
+        self.journal = journal
+        self.entries = []
+        self.count = 0
+        # (count, size) to load later, so startup doesn't wait on parsing the journal
+        self.pending = None
+
+    # restore count moves played out of size recorded in the journal
+    def load(self, count, size):
+        self.pending = None
+        self.entries = []
+        for index in range(size):
+            try:
+                self.entries.append(literal_eval(self.journal.get(index)))
+            except (KeyError, ValueError, SyntaxError):
+                break
+        self.count = min(count, len(self.entries))
+
+    def __len__(self): return len(self.entries)
+
+    def can_undo(self): return self.count > 0
+
+    def can_redo(self): return self.count < len(self.entries)
+
+    # new move - anything which could have been redone is dropped
+    def push(self, move):
+        del self.entries[self.count:]
+        self.entries.append([dict(move)])
+        self.count += 1
+        self.log(self.count-1)
+
+    # extra move made as part of the last one
+    def append(self, move):
+        if self.count == 0: return self.push(move)
+        self.entries[self.count-1].append(dict(move))
+        self.log(self.count-1)
+
+    # moves to run in reverse to undo the last entry - copies, as do_move updates them
+    def undo(self):
+        self.count -= 1
+        return [dict(move) for move in reversed(self.entries[self.count])]
+
+    def redo(self):
+        self.count += 1
+        return [dict(move) for move in self.entries[self.count-1]]
+
+    # entries to run to get from the current position to move n, as (moves, reverse)
+    def seek(self, n):
+        n = max(0, min(n, len(self.entries)))
+        steps = []
+        while self.count > n: steps.append((self.undo(), True))
+        while self.count < n: steps.append((self.redo(), False))
+        return steps
+
+    def reset(self):
+        self.entries = []
+        self.count = 0
+        self.pending = None
+        self.journal.reset()
+
+    def log(self, index):
+        self.journal.set(index, repr(self.entries[index]))
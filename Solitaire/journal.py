@@ -0,0 +1,48 @@
+import os
+
+from perf import PERF
+
+# append-only log of the move history - one line per change to a history entry:
+#   <index> <python literal list of move dicts>
+# later lines for the same index replace earlier ones. Lines are buffered and
+# only written on flush, so a run of moves costs a single small append.
+class Journal(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.moves = {}
+        self.pending = []
+        self.truncate = False
+        self.load()
+
+    # read back history - ignores a torn line left by an interrupted write
+    def load(self):
+        if not os.path.exists(self.path): return
+        with open(self.path) as f:
+            for line in f:
+                if not line.endswith('\n'): break
+                index, _, text = line.rstrip('\n').partition(' ')
+                if index.isdigit() and text:
+                    self.moves[int(index)] = text
+
+    def __len__(self): return len(self.moves)
+
+    def get(self, index): return self.moves[index]
+
+    def set(self, index, text):
+        self.moves[index] = text
+        self.pending.append("%d %s\n" % (index, text))
+
+    # start a new game - old log is dropped at next flush
+    def reset(self):
+        self.moves = {}
+        self.pending = []
+        self.truncate = True
+
+    def flush(self):
+        if not self.pending and not self.truncate: return
+        with PERF.timer('journal_write'):
+            with open(self.path, 'w' if self.truncate else 'a') as f:
+                f.writelines(self.pending)
+        self.pending = []
+        self.truncate = False
@@ -1,24 +1,34 @@
-import ast
+import os
 import time
 
+# startup phases are timed from here, before kivy is imported
+START_TIME = time.time()
+
 from functools import partial
 
 import kivy
 from kivy.app import App
 from kivy.clock import Clock
+from kivy.config import Config
 from kivy.logger import Logger
-from kivy.properties import NumericProperty, ObjectProperty
+from kivy.properties import NumericProperty, ObjectProperty, StringProperty
 from kivy.core.window import Window
 from kivy.uix.label import Label
-from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.popup import Popup
-from kivy.metrics import Metrics
 from kivy.utils import platform
-from kivy.uix.image import Image
-from kivy.uix.button import Button
-from kivy.core.audio import SoundLoader
-from cards import Deck
+from cards import Deck, deal_id, parse_deal_id
 from basegame import BaseGame
+from journal import Journal
+from snapshot import Snapshot
+from history import History
+from animator import Animator
+from sounds import Sounds
+from dealpool import DealPool
+from perf import PERF, timed
+from stats import Stats
+from gameclock import GameClock
+import cardatlas
+from solver import Solver
 import games
 
 GAMES = {}
@@ -33,11 +43,18 @@ def get_subclasses(base):
 def register_games():
     global GAMES
     for plugin in get_subclasses(BaseGame):
-        Logger.info("Cards: load game %s" % plugin.name)
+        Logger.info("Cards: load game %s", plugin.name)
         GAMES[plugin.name] = plugin
 
-game_start_sound = SoundLoader.load('SS.mp3')
-card_flip_sound = SoundLoader.load('44444.mp3')
+_phase_time = START_TIME
+
+# log time taken by each phase of startup
+def startup_phase(name):
+    global _phase_time
+    now = time.time()
+    Logger.info("Cards: startup %s took %.3fs, %.3fs since launch", name, now-_phase_time, now-START_TIME)
+    _phase_time = now
+
 # main app
 class Solitaire(App):
     score = NumericProperty(0)
@@ -50,28 +67,67 @@ class Solitaire(App):
     time_remaining = NumericProperty(0)
     end_time = NumericProperty(0)
     timer_label = ObjectProperty(None)
+    deal_id = StringProperty('')
     popup_shown = False
+    checkpoint_interval = 5
+    _dirty = False
+    _config_dirty = False
+    won = False
+    deal_time = 1.0
+    timer_event = None
+    overlay = None
 
     def on_start(self):   
         self.root_window.size = (1280, 720)
+        Window.bind(on_flip=self.first_frame)
+
+    def first_frame(self, *args):
+        Window.unbind(on_flip=self.first_frame)
+        Clock.schedule_once(self.deferred, 0)
+
+    # work which isn't needed to show the board - run once the first frame is up
+    def deferred(self, *args):
+        startup_phase('first frame')
+        history = self.history
+        if history.pending:
+            history.load(*history.pending)
+            self.set_moves()
+        self.deals.fill(GAMES[self.game.name])
+        self.sounds.load(then='start')
+        cardatlas.build_later()
+        startup_phase('deferred')
         
 
-    def start_timer(self):
-        self.time_remaining = 600
-        Clock.schedule_interval(self.update_timer, 1)
+    # restart the game clock from elapsed seconds - it stays stopped on a won game
+    def start_timer(self, elapsed=0.0):
+        self.game_clock.reset(elapsed)
+        if not self.won:
+            self.game_clock.start()
+        self.update_timer()
+
+    # refresh the countdown, then wait until the second shown next changes
+    def update_timer(self, *args):
+        if self.timer_event is not None:
+            self.timer_event.cancel()
+            self.timer_event = None
+        if self.timer_label is None: return
+        shown, delay = self.game_clock.display()
+        if shown != self.time_remaining:
+            self.time_remaining = shown
+            self.timer_label.text = str(shown)
+        if shown == 0:
+            self.game_over()
+        elif self.game_clock.running():
+            self.timer_event = Clock.schedule_once(self.update_timer, delay)
 
-    def update_timer(self, dt):
-        if self.time_remaining > 0:
-            self.time_remaining -= 1  
-            self.timer_label.text = str(self.time_remaining)
-        else:
-            self.game_over() 
-            
 
     def game_over(self):
         # ตรวจสอบว่า Popup ยังไม่ได้แสดง
+        self.game_clock.stop()
         if not self.popup_shown:
             # สร้าง Popup เพียงครั้งเดียว
+            from kivy.uix.boxlayout import BoxLayout
+            from kivy.uix.button import Button
             content = BoxLayout(orientation='vertical')
             popup = Popup(title='Game Over',
                           content=content,
@@ -88,20 +144,16 @@ class Solitaire(App):
     def restart_game(self, popup):
         # ปิด Popup ก่อน
         popup.dismiss()
-        self.clear()
-        self.start_timer()
-        # เริ่มต้นนับเวลาถอยหลังใหม่
-
+        self.popup_shown = False
+        self.new_deal()
 
     # initialise config file
     def build_config(self, config):
         #self.games = games.register()
         names = sorted(GAMES.keys())
-        config.setdefaults('game', {'name': names[0], 'score': 0, 'won':False})
-        config.setdefaults('moves', {'count': 0, 'max': 0})
-        config.setdefaults('piles', {})
+        config.setdefaults('game', {'name': names[0]})
         config.setdefaults('settings', {'fps': 10, 'font_size': 16, 'help_font_size': 14, 
-            'popup_width': 0.4, 'popup_height': 0.6})
+            'popup_width': 0.4, 'popup_height': 0.6, 'replay_speed': 0, 'perf_overlay': 0})
 
     # settings panel
     def build_settings(self, settings):
@@ -120,141 +172,256 @@ class Solitaire(App):
               "section": "settings", "key": "popup_width" },
             { "type": "numeric", "title": "Popup height",
               "desc": "height of popup as fraction of screen",
-              "section": "settings", "key": "popup_height" }
+              "section": "settings", "key": "popup_height" },
+            { "type": "numeric", "title": "Replay speed",
+              "desc": "moves per second when jumping through the history, 0 to jump straight there",
+              "section": "settings", "key": "replay_speed" },
+            { "type": "bool", "title": "Performance overlay",
+              "desc": "show frame rate and timings, also toggled with F12",
+              "section": "settings", "key": "perf_overlay" }
         ]''')
 
     # user updated config 
     def on_config_change(self, config, section, key, value):
         if config is self.config and section == 'settings' and key == 'font_size':
             self.font_size = int(value)
+        if config is self.config and section == 'settings' and key == 'perf_overlay':
+            self.show_perf(value == '1')
 
     # initialise new game
     def set_game(self, name):
         self.game = GAMES[name](root=self.root, on_move=self.on_move, menu_size=self.menu_height)
         self.game.build()
-        conf = self.config
-        if not conf.has_section(name):
-            conf.add_section(name)
-            conf.set(name, 'played', 1)
-            conf.set(name, 'won', 0)
-            conf.set(name, 'best_moves', 0)
-            conf.set(name, 'avg_moves', 0)
-        conf.write()
+        self.touch()
  
-    # shuffle the deck
-    def shuffle(self):
+    # shuffle the deck - deal id picks a given deal, else take one from the pool
+    def shuffle(self, deal=None):
         self.deck = Deck(self.game.decks)
-        self.deck.rewind(shuffle=True)
-        self.deck.save(self.config)
-        self.config.set('game', 'won', False)
-        if self.moves > 0:
-            self.config.set(self.game.name, 'played', self.getval('played')+1)
-        self.set_moves(0, True)
+        if deal:
+            seed = parse_deal_id(deal)
+        else:
+            seed = self.deals.take(GAMES[self.game.name])
+        self.deck.rewind(shuffle=True, seed=seed)
+        self.deal_id = deal_id(self.deck.seed)
+        Logger.info("Cards: new deal %s", self.deal_id)
+        self.won = False
+        self.start_timer()
+        self.history.reset()
+        self.set_moves(reset=True)
          
     # initialise the board
     def build(self):
+        startup_phase('config')
         conf = self.config
-        name = conf.get('game', 'name')
+        path = os.path.splitext(self.get_application_config())[0]
+        self.snapshot_path = path + '.snap'
+        snap = Snapshot.read(self.snapshot_path)
+        name = snap.name if snap is not None else conf.get('game', 'name')
         self.font_size = conf.getint('settings', 'font_size')
-        Logger.info("Cards: build game %s font size %d" % (name, self.font_size))
+        Logger.info("Cards: build game %s font size %d", name, self.font_size)
         chooser = self.root.chooser
         chooser.values = sorted(GAMES.keys())
         if not name in list(GAMES.keys()):
             name = sorted(GAMES.keys())[0]
         chooser.text = name
         chooser.bind(text=self.choose)
+        cardatlas.load()
+        self.journal = Journal(path + '.moves')
+        self.history = History(self.journal)
+        self.deals = DealPool(path + '.deals')
+        self.scores = Stats(path + '.db')
+        self.game_clock = GameClock()
+        if self.scores.import_config(conf, GAMES.keys()):
+            self.touch_config()
+        self.animator = Animator()
+        self.sounds = Sounds()
         self.set_game(name)
-        self._starting = False
-        if conf.has_option('game', 'deck'):
-            # restore where we left off
-            self.deck = Deck(self.game.decks, config=conf)
-            self.moves = conf.getint('moves', 'count')
-            self.max_moves = conf.getint('moves', 'max')
-            self.score = conf.getint('game', 'score')
-            for pile in self.game.all_piles():
-                pile.load(conf)
+        elapsed = 0
+        if snap is not None and self.restore(snap):
+            elapsed = snap.elapsed/1000.0
+        elif Deck.saved(conf):
+            self.restore_config()
         else:
             # first time initialisation
             self.shuffle()
-            for pile in self.game.all_piles():
-                self.game.start(pile, self.deck)
-                pile.save(conf)
-            conf.write()
-        if platform == 'android':
-            Window.bind(on_keyboard=self.hook_keyboard)
-        Window.on_resize = self.resize
+            for pid in self.game.deal_order():
+                self.deal_pile(pid)
+            self.touch()
+        startup_phase('board')
+        self.checkpoint()
+        Clock.schedule_interval(self.checkpoint, self.checkpoint_interval)
+        Window.bind(on_keyboard=self.hook_keyboard)
+        Window.bind(on_resize=self.resize)
         delay = self.framerate();
         Logger.info("Cards: resize delay = %g", delay)
-        self.resize_event = Clock.create_trigger(lambda dt: self.game.do_resize(), delay)
+        self.resize_event = Clock.create_trigger(self.do_resize, delay)
         self.timer_label = Label(text=str(self.time_remaining), font_size=50,color=(1, 0, 0, 1), size_hint=(None, None), pos_hint={'left': 1, 'top': 1})
         self.root.add_widget(self.timer_label)
-        self.start_timer()
+        self.start_timer(elapsed)
+        self.perf_path = path + '.perf'
+        if conf.getboolean('settings', 'perf_overlay'):
+            self.show_perf(True)
+        startup_phase('build')
+
+    # restore where we left off - history is only parsed after the first frame
+    def restore(self, snap):
+        board = self.game.board
+        if snap.name != self.game.name or sorted(pid for pid, _ in snap.piles) != sorted(board.order):
+            Logger.warning("Cards: snapshot does not match game %s", self.game.name)
+            return False
+        self.deck = Deck(self.game.decks)
+        self.deck.restore(snap.seed, snap.deck)
+        self.deal_id = deal_id(self.deck.seed)
+        self.score = snap.score
+        self.won = snap.won
+        for pid, cards in snap.piles:
+            board.set(pid, cards)
+        for pile in self.game.all_piles():
+            pile.sync()
+        self.moves, self.max_moves = snap.moves, snap.max_moves
+        self.history.pending = (self.moves, self.max_moves)
+        return True
+
+    # older versions saved the game in the config file - read it back from there and
+    # move it over to the snapshot
+    def restore_config(self):
+        conf = self.config
+        self.deck = Deck(self.game.decks, config=conf)
+        self.deal_id = deal_id(self.deck.seed)
+        self.score = conf.getint('game', 'score', fallback=0)
+        self.won = conf.getboolean('game', 'won', fallback=False)
+        for pile in self.game.all_piles():
+            pile.load(conf)
+        self.moves = conf.getint('moves', 'count', fallback=0)
+        self.max_moves = conf.getint('moves', 'max', fallback=0)
+        self.import_history()
+        self.history.pending = (self.moves, self.max_moves)
+        for key in ('seed', 'deck', 'score', 'won'):
+            conf.remove_option('game', key)
+        conf.remove_section('moves')
+        conf.remove_section('piles')
+        self.touch()
+        self.touch_config()
         
 
-    # bind android back key
+    # bind android back key, and F12 to show the performance overlay
     def hook_keyboard(self, window, key, *args):
-         if key == 27:
+         if key == 27 and platform == 'android':
             self.undo()
             return True
+         if key == 293:
+            self.show_perf(self.overlay is None or self.overlay.parent is None)
+            return True
+
+    # performance figures are written out when the overlay is closed
+    def show_perf(self, show):
+        if show:
+            from overlay import PerfOverlay
+            if self.overlay is None: self.overlay = PerfOverlay()
+            self.overlay.show(self.root)
+        elif self.overlay is not None and self.overlay.parent is not None:
+            self.overlay.hide()
+            self.dump_perf()
+
+    def dump_perf(self):
+        from pile import POOL
+        PERF.dump(self.perf_path, game=self.game.name, pool=POOL.stats())
 
     # called on window resize
-    def resize(self, width, height):
+    def resize(self, window, width, height):
         if self.resize_event.is_triggered:
             self.resize_event.cancel()
         self.resize_event()
 
-    # draws the cards on new game - animate this
-    # have some hacky logic here so this is not called while it is running
-    def start(self, index, *args):
-        if index == 0:
-            self._starting = True
-              # เริ่มต้นการนับเวลาเมื่อเริ่มเกม
-        pile = (self.game.tableau()+self.game.waste())[index]
-        self.game.start(pile, self.deck)
-        if index+1 < self.game.num_tableau + self.game.num_waste:
-            Clock.schedule_once(partial(self.start, index+1), self.framerate())
-        else:
-            for pile in self.game.all_piles():
-                pile.save(self.config)
-            self.config.write()
-            self._starting = False
-            Clock.unschedule(self.update_timer)  # หยุดการนับเวลาเมื่อเกมสิ้นสุด
-            Clock.unschedule(self.update_timer)  # หยุดการนับถอยหลังเมื่อเวลาสุดท้ายถึง
+    @timed('resize')
+    def do_resize(self, *args):
+        self.animator.finish_tweens()
+        self.game.do_resize()
+
+    # draws the cards on new game one pile at a time, taking deal_time whatever the fps
+    def start(self):
+        pids = self.game.deal_order()
+        delay = self.deal_time/len(pids)
+        for pid in pids:
+            self.animator.add(delay, self.deal_pile, pid)
+        self.animator.add(0, self.dealt)
+
+    @timed('deal')
+    def deal_pile(self, pid):
+        self.game.start(pid, self.deck)
+
+    def dealt(self):
+        self.touch()
  
-    # callback from game chooser
-    def choose(self, chooser, choice):
-        if self._starting: return
-        Logger.debug("Cards: choose game %s" % choice)
+    # callback from game chooser - anything still being dealt or moved is dropped
+    def choose(self, chooser, choice, deal=None):
+        Logger.debug("Cards: choose game %s", choice)
+        self.animator.cancel()
+        self.record_abandoned()
         self.config.set('game', 'name', choice)
-        self.config.write()
+        self.touch_config()
         self.game.clear(0)
         self.set_game(choice)
-        self.shuffle()
-        self.start(0)
+        self.shuffle(deal)
+        self.start()
+
+    # start a new game, optionally from a deal id
+    def new_deal(self, deal=None):
+        try:
+            if deal: parse_deal_id(deal)
+        except ValueError:
+            Logger.warning("Cards: invalid deal id %r", deal)
+            self.root.ids.deal.text = self.deal_id
+            return
+        self.animator.cancel()
+        self.record_abandoned()
+        self.game.clear(1)
+        self.shuffle(deal)
+        self.start()
 
  
     def restart(self):
-        if card_flip_sound:
-          card_flip_sound.play()
-        if self._starting: return
+        self.sounds.play('flip')
         Logger.debug("Cards: restart")
+        self.animator.cancel()
         self.game.clear(1)
         self.deck.rewind()
-        self.set_moves(0, True)
-        self.start(0)
-        self._starting = True
+        self.history.reset()
+        self.set_moves(reset=True)
+        self.start()
         
     def undo(self):
-        if card_flip_sound:
-          card_flip_sound.play()
-        Logger.debug("Cards: undo %d" % self.moves)
-        if self.moves > 0:
-            self.set_moves(self.moves-1)
-            self.perform_move(self.moves, reverse=True)
+        self.sounds.play('flip')
+        Logger.debug("Cards: undo %d", self.moves)
+        self.animator.finish()
+        if self.history.can_undo():
+            self.perform_move(self.history.undo(), reverse=True)
+            self.set_moves()
+
+    def redo(self):
+        Logger.debug("Cards: redo %d of %d", self.moves, self.max_moves)
+        self.animator.finish()
+        if self.history.can_redo():
+            self.perform_move(self.history.redo())
+            self.set_moves()
     
+    # highlight the best next move found by the solver
+    def hint(self):
+        solver = Solver(GAMES[self.game.name], max_time=self.framerate())
+        move = solver.hint(self.game.board)
+        Logger.info("Cards: hint %r after %d nodes", move, solver.nodes)
+        if move is None: return
+        src, dst, num = move[:3]
+        images = self.game.pile(src).top_images(num) + self.game.pile(dst).top_images(1)
+        self.highlight(images, 1)
+        Clock.schedule_once(partial(self.highlight, images, 0), 1)
+
+    def highlight(self, images, alpha, *args):
+        for img in images: img.alpha = alpha
+
     def help(self):
-        if card_flip_sound:
-          card_flip_sound.play()
+        from kivy.uix.image import Image
+        self.sounds.play('flip')
         popup = Popup(title='rule game',
                   content=Image(source='AD.png'),
                   size_hint=(None, None), size=(800, 700))
@@ -274,114 +441,208 @@ class Solitaire(App):
 
     # update stats and show popup on completed game
     def check_score(self):
-        conf = self.config
-        if self.score == self.game.max_score and not conf.getboolean('game','won'):
-            conf.set('game', 'won', True)
-            name = self.game.name
-            won = self.getval('won')
-            best = self.getval('best_moves')
-            avg = self.getval('avg_moves', 'float')
-            conf.set(name, 'won', won+1)
-            if best == 0 or self.moves < best:
-                conf.set(name, 'best_moves', self.moves)
-            conf.set(name, 'avg_moves', (avg*won+self.moves)/(won+1))
-            conf.write()
+        if self.score == self.game.max_score and not self.won:
+            self.won = True
+            self.game_clock.stop()
+            self.update_timer()
+            self.record_game()
             self.stats(title='congratulations - you won!')
             return True
 
-    # get value from config file
-    def getval(self, key, typ='int'):
-        if typ == 'int':
-            val = self.config.getint(self.game.name, key)
-        elif typ == 'float':
-            val = self.config.getfloat(self.game.name, key)
-        else:
-            val = self.config.get(self.game.name, key)
-        return val
+    # add the current game to the stats - saved at the next checkpoint
+    def record_game(self):
+        self.scores.record(self.game.name, self.deck.seed, self.moves, self.score,
+                           self.game_clock.elapsed(), self.won)
+
+    # a game given up for a new deal still counts as played - call before leaving it
+    def record_abandoned(self):
+        if self.moves > 0 and not self.won:
+            self.record_game()
+
+    # stats for the current game
+    def stats(self, title='statistics'):
+        name = self.game.name
+        scores = self.scores
+        summary = scores.summary(name)
+        streaks = scores.streaks(name)
+        moves = scores.percentiles(name)
+        best = scores.best_time(name)
+        played, won = summary['played'], summary['won']
+        data = ['played', str(played),
+                'won', "%d (%d%%)" % (won, 100*won/played) if played else '0',
+                'win streak', "%d (best %d)" % (streaks['current'], streaks['longest']),
+                'best moves', str(summary['best_moves'] or '-'),
+                'average moves', "%.1f" % summary['avg_moves'] if won else '-',
+                'moves 25/50/90%', '/'.join(str(moves[p]) for p in (25, 50, 90)) if moves else '-',
+                'best time', "%d:%02d" % divmod(int(best), 60) if best is not None else '-']
+        font_size = self.config.getint('settings', 'help_font_size')
+        popup = self.new_popup("%s %s" % (name, title), [0.5, 0.5], data, font_size)
+        popup.open()
 
     # logs the history and, if callback is set then defer drawing to animate
-    def on_move(self, orig, dest, num, **args):
-        Logger.debug("Cards: on_move %d" % self.moves)
-        if card_flip_sound:
-            card_flip_sound.play()
+    @timed('on_move')
+    def on_move(self, src, dst, num, **args):
+        Logger.debug("Cards: on_move %d", self.moves)
+        self.sounds.play('flip')
         do_callback = False
         if 'callback' in args:
             do_callback = args['callback'] is not False
             callback = args['callback']
             del args['callback']
-        args['src'] = orig.pid()
-        args['dst'] = dest.pid()
+        args['src'] = src
+        args['dst'] = dst
         args['n'] = num
-        conf = self.config
+        # seconds into the game, kept with the move in the history
+        args['time'] = round(self.game_clock.elapsed(), 3)
         if args.get('append', False):
-            text = conf.get('moves', str(self.moves-1))
-            text = text[:-1] + ',' + repr(args) + ']'
-            conf.set('moves', str(self.moves-1), text)
-            conf.write()
+            self.history.append(args)
         else:
-            conf.set('moves', str(self.moves), '[' + repr(args) + ']')
-            self.set_moves(self.moves+1)
+            self.history.push(args)
+            self.set_moves()
         # do it
         if do_callback:
-            Clock.schedule_once(partial(self.draw, args, callback), self.framerate())
+            self.animator.add(self.framerate(), self.draw, args, callback)
         else:
             self.do_move(args)
 
     # draw move from timer event
-    def draw(self, move, callback, *args):
-        self.do_move(move)
+    def draw(self, move, callback):
+        self.draw_move(move)
         if callback: callback()
 
-    # read move from config and execute it
-    def perform_move(self, count, reverse=False):
-        text = self.config.get('moves', str(count))
-        Logger.debug("Cards: perform_move %d" % count)
-        if card_flip_sound:
-         card_flip_sound.play()
-        moves = ast.literal_eval(text)
-        if reverse:
-            moves.reverse()
-        self.move_cb(moves, reverse)
-
-    # step through moves in list
-    def move_cb(self, moves, reverse, *args):
-        if len(moves) == 0: return
-        self.do_move(moves[0], reverse, True)
-        Clock.schedule_once(partial(self.move_cb, moves[1:], reverse), self.framerate())
-
-    # execute move and update state
-    def do_move(self, move, reverse=False, replay=False):
-        orig, dest, score = self.game.do_move(move, reverse)
-        Logger.debug("Cards: do_move %s to %s score %d += %d" % (orig, dest, self.score, score))
+    # replay a history entry - moves to undo are already in reverse order
+    def perform_move(self, moves, reverse=False):
+        Logger.debug("Cards: perform_move %d moves", len(moves))
+        self.sounds.play('flip')
+        self.animate([(move, reverse) for move in moves], self.framerate())
+
+    # jump to move n in the history. Moves are applied straight to the board with
+    # a single redraw at the end, or animated at speed moves per second if set
+    def replay(self, n, speed=None):
+        self.animator.finish()
+        if speed is None:
+            speed = self.config.getfloat('settings', 'replay_speed')
+        steps = self.history.seek(n)
+        Logger.info("Cards: replay to move %d in %d steps", self.history.count, len(steps))
+        moves = [(move, reverse) for entry, reverse in steps for move in entry]
+        if speed > 0:
+            self.animate(moves, 1.0/speed)
+        else:
+            self.apply_moves(moves)
+        self.set_moves()
+
+    # update the board for a list of (move, reverse) pairs and redraw changed piles once
+    def apply_moves(self, moves):
+        changed = set()
+        for move, reverse in moves:
+            changed.update(self.do_move(move, reverse, replay=True, draw=False))
+        for pid in changed:
+            self.game.pile(pid).sync()
+
+    # queue (move, reverse) pairs to be drawn one per delay
+    def animate(self, moves, delay):
+        for move, reverse in moves:
+            self.animator.add(delay, self.draw_move, move, reverse, True)
+
+    # move with the cards sliding over from where they were
+    def draw_move(self, move, reverse=False, replay=False):
+        src, dst, num = move['src'], move['dst'], move['n']
+        if reverse: src, dst = dst, src
+        x, y = self.game.pile(src).top_pos(num)
+        self.do_move(move, reverse, replay)
+        dest = self.game.pile(dst)
+        x1, y1 = dest.top_pos(num)
+        self.animator.tween(dest.top_images(num), x-x1, y-y1, self.framerate())
+
+    # execute move and update state, returns the piles which changed
+    def do_move(self, move, reverse=False, replay=False, draw=True):
+        src, dst, score = self.game.do_move(move, reverse, draw)
+        Logger.debug("Cards: do_move %r to %r score %d += %d", src, dst, self.score, score)
         if score:
             self.score += score
-            self.config.set('game', 'score', self.score)
             self.check_score()
-        orig.save(self.config)
-        dest.save(self.config)
-        self.config.write()
+        self.touch()
         # user callback
         if not replay:
             self.game.on_moved(move)
+        return src, dst
   
-    # save no. of moves and reset score on new game
-    def set_moves(self, val, reset=False):
-        self.moves = val
-        self.max_moves = val if reset else max(self.max_moves, val)
-        conf = self.config
-        conf.set('moves', 'count', self.moves)
-        conf.set('moves', 'max', self.max_moves)
-        if self.moves == 0 and reset:
+    # save position in move history and reset score on new game
+    def set_moves(self, reset=False):
+        self.moves = self.history.count
+        self.max_moves = len(self.history)
+        if reset:
             self.score = 0
-            conf.set('game', 'score', 0)
-        conf.write()
-
-    # callbacks to allow android save and resume
+        self.touch()
+
+    # mark game state or settings as changed - saved at the next checkpoint
+    def touch(self):
+        self._dirty = True
+
+    def touch_config(self):
+        self._config_dirty = True
+
+    # current game state for the snapshot file
+    def snapshot(self):
+        board = self.game.board
+        return Snapshot(self.game.name, self.deck.seed, self.deck.d.tobytes(), self.score,
+                        self.moves, self.max_moves, int(1000*self.game_clock.elapsed()), self.won,
+                        [(pid, board.cards(pid)) for pid in board.order])
+
+    # flush the move journal and finished games, then write the snapshot and config if they have changed.
+    # The board is behind the history while moves are still being drawn, so wait.
+    def checkpoint(self, *args):
+        self.journal.flush()
+        self.scores.flush()
+        if self._dirty and not self.animator.busy():
+            with PERF.timer('snapshot_write'):
+                self.snapshot().write(self.snapshot_path)
+            self._dirty = False
+        if self._config_dirty:
+            with PERF.timer('config_write'):
+                self.config.write()
+            self._config_dirty = False
+
+    # move history used to be stored in the config file - move it to the journal
+    def import_history(self):
+        conf = self.config
+        if not conf.has_section('moves'): return
+        for key in conf.options('moves'):
+            if key.isdigit():
+                if int(key) not in self.journal.moves:
+                    self.journal.set(int(key), conf.get('moves', key))
+                conf.remove_option('moves', key)
+                self.touch_config()
+
+    # callbacks to allow android save and resume - the game clock stops while paused
     def on_pause(self):
+        self.game_clock.pause()
+        self.animator.finish()
+        self.touch()
+        self.checkpoint()
         return True
 
+    def on_stop(self):
+        self.animator.finish()
+        self.touch()
+        self.checkpoint()
+        self.deals.close()
+        self.scores.close()
+        self.save_window()
+        if self.overlay is not None and self.overlay.parent is not None:
+            self.dump_perf()
+
+    # window size is only written on exit, not on every resize
+    def save_window(self):
+        size = (str(Window.width), str(Window.height))
+        if size != (Config.get('graphics', 'width'), Config.get('graphics', 'height')):
+            Config.set('graphics', 'width', size[0])
+            Config.set('graphics', 'height', size[1])
+            Config.write()
+
     def on_resume(self):
-        pass
+        self.game_clock.resume()
+        self.update_timer()
 
     def framerate(self):
         return 1.0 / self.config.getfloat('settings','fps')
@@ -391,6 +652,5 @@ class AppPopup(Popup):
 
 if __name__ == '__main__':
     register_games()
-    if game_start_sound:
-        game_start_sound.play()  # เพิ่มเสียงเมื่อเกมเริ่มต้น
+    startup_phase('imports')
     Solitaire().run()
\ No newline at end of file
@@ -0,0 +1,66 @@
+import time
+
+from kivy.clock import Clock
+from kivy.uix.label import Label
+
+from perf import PERF
+from pile import POOL
+
+WRITES = ('config_write', 'snapshot_write', 'journal_write')
+
+# on screen performance figures - fps, frame time, widgets alive and file writes.
+# Timing of the instrumented calls is switched on while it is showing.
+class PerfOverlay(Label):
+    interval = 0.5
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('size_hint', (None, None))
+        kwargs.setdefault('pos_hint', {'right': 1, 'top': 0.93})
+        kwargs.setdefault('halign', 'right')
+        kwargs.setdefault('color', (1, 1, 0, 1))
+        super(PerfOverlay, self).__init__(**kwargs)
+        self.bind(texture_size=self.setter('size'))
+        self.events = []
+
+    def show(self, root):
+        if self.parent is not None: return
+        PERF.enabled = True
+        root.add_widget(self)
+        self.reset()
+        self.events = [Clock.schedule_interval(self.frame, 0),
+                       Clock.schedule_interval(self.update, self.interval)]
+
+    def hide(self):
+        if self.parent is None: return
+        PERF.enabled = False
+        for event in self.events: event.cancel()
+        self.events = []
+        self.parent.remove_widget(self)
+
+    def reset(self):
+        self.frames, self.frame_time, self.worst = 0, 0.0, 0.0
+        self.writes = self.count_writes()
+        self.last = time.perf_counter()
+
+    def count_writes(self):
+        return sum(PERF.counts.get(name, 0) for name in WRITES)
+
+    def frame(self, dt):
+        self.frames += 1
+        self.frame_time += dt
+        self.worst = max(self.worst, dt)
+
+    def update(self, dt):
+        now = time.perf_counter()
+        writes = self.count_writes()
+        rate = (writes - self.writes) / (now - self.last)
+        frame = self.frame_time / self.frames if self.frames else 0
+        widgets = sum(1 for _ in self.parent.walk()) - 1
+        pool = POOL.stats()
+        self.text = ("%.0f fps  frame %.1f ms (max %.1f)\n"
+                     "%d widgets  pool %d free of %d\n"
+                     "%.1f writes/s  %d moves" % (
+                     Clock.get_fps(), 1000*frame, 1000*self.worst,
+                     widgets, pool['free'], pool['created'],
+                     rate, PERF.counts.get('do_move', 0)))
+        self.reset()
@@ -0,0 +1,78 @@
+import json
+import time
+from functools import wraps
+
+# counters and timers for the hot paths - no kivy imports, so the headless model
+# can be instrumented too. Calls are always counted, which is just a dict update;
+# they are only timed while enabled, e.g. when the overlay is showing.
+class Perf(object):
+
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.counts = {}
+        self.times = {}
+        self.started = time.perf_counter()
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    # total and worst time for name
+    def add_time(self, name, seconds):
+        total, worst = self.times.get(name, (0.0, 0.0))
+        self.times[name] = (total+seconds, max(worst, seconds))
+
+    # count and time a block: with PERF.timer('name'): ...
+    def timer(self, name):
+        return Timer(self, name)
+
+    def stats(self):
+        stats = {}
+        for name, calls in self.counts.items():
+            total, worst = self.times.get(name, (0.0, 0.0))
+            stats[name] = dict(calls=calls, total=total, max=worst,
+                               mean=total/calls if total else 0.0)
+        return stats
+
+    def dump(self, path, **extra):
+        data = dict(extra, elapsed=time.perf_counter()-self.started, stats=self.stats())
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+
+
+class Timer(object):
+
+    def __init__(self, perf, name):
+        self.perf = perf
+        self.name = name
+
+    def __enter__(self):
+        self.perf.count(self.name)
+        self.start = time.perf_counter() if self.perf.enabled else None
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            self.perf.add_time(self.name, time.perf_counter()-self.start)
+
+
+PERF = Perf()
+
+# decorator to count and time calls to a function
+def timed(name):
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            counts = PERF.counts
+            counts[name] = counts.get(name, 0) + 1
+            if not PERF.enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                PERF.add_time(name, time.perf_counter()-start)
+        return wrapper
+    return decorate
@@ -1,19 +1,20 @@
 import ast
-from kivy.core.window import Window
+from kivy.graphics import Color, Rectangle
 from kivy.properties import ListProperty, NumericProperty, ObjectProperty
 from kivy.uix.image import Image
 from kivy.uix.label import Label
 from kivy.uix.scatter import Scatter
+from kivy.uix.widget import Widget
 from kivy.logger import Logger
 
-from cards import Card, Deck
-from basegame import BaseGame
-import games
+from cards import Card
+from perf import timed
 
 # mixin class for group of cards
 class CardsList(object):
     images = ListProperty([])
     split = False
+    stacked = False
 
     def cards(self): return len(self.images)
 
@@ -24,12 +25,45 @@ class CardsList(object):
     def bottom_card(self): return self.images[0].card
 
 
+# free list of card widgets, so moves reuse widgets rather than building new ones
+# and setting up their property bindings each time
+class WidgetPool(object):
+    max_free = 256
+
+    def __init__(self):
+        self.free = {}
+        self.created = 0
+        self.reused = 0
+
+    def get(self, cls, **kwargs):
+        free = self.free.get(cls)
+        if free:
+            widget = free.pop()
+            widget.reset(**kwargs)
+            self.reused += 1
+        else:
+            widget = cls(**kwargs)
+            self.created += 1
+        return widget
+
+    # widget must already be removed from its parent
+    def release(self, widget):
+        widget.recycle(self)
+        free = self.free.setdefault(type(widget), [])
+        if len(free) < self.max_free:
+            free.append(widget)
+
+    def stats(self):
+        return dict(created=self.created, reused=self.reused,
+                    free=sum(len(free) for free in self.free.values()))
+
+
 # on screen card image
 class CardImage(Image, CardsList):
     alpha = NumericProperty(0)
     yoffset = NumericProperty(0)
-    callback = ObjectProperty(None)
-    card = ObjectProperty(None)
+    callback = ObjectProperty(None, allownone=True)
+    card = ObjectProperty(None, allownone=True)
  
     def __init__(self, **kwargs):
         super(CardImage, self).__init__(**kwargs)
@@ -44,15 +78,29 @@ class CardImage(Image, CardsList):
 
     def lock(self, state): pass
 
+    # back to state of a new widget, then apply properties
+    def reset(self, **kwargs):
+        self.alpha = 0
+        self.yoffset = 0
+        self.pos = (0, 0)
+        self.callback = None
+        self.card = None
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    def recycle(self, pool):
+        self.callback = None
+        self.card = None
+
     def resize(self, xpos, ypos, size, xstep=0, ystep=0):
-        Logger.debug("Cards: image resize %s at %d,%d" % (size, xpos, ypos))
+        Logger.debug("Cards: image resize %s at %d,%d", size, xpos, ypos)
         self.images[0].size = size
         self.pos = (xpos, ypos)
         return xpos+xstep, ypos-ystep
 
 class CardScatter(Scatter, CardsList):
-    callback = ObjectProperty(None)
-    pile = ObjectProperty(None)
+    callback = ObjectProperty(None, allownone=True)
+    pile = ObjectProperty(None, allownone=True)
     selected = 0
     
     # add a new image to top of pile
@@ -85,7 +133,7 @@ class CardScatter(Scatter, CardsList):
             if i > 0:
                 pos = (pos[0]+xstep, pos[1]-ystep)
         self.pos = pos
-        Logger.debug("Cards: scatter pos -> %d,%d" % pos)
+        Logger.debug("Cards: scatter pos -> %d,%d", *pos)
         yoff = 0
         for img in reversed(self.images):
             #Logger.debug("Cards: scatter yoffset %d -> %d" % (ystep, yoff))
@@ -107,7 +155,7 @@ class CardScatter(Scatter, CardsList):
                 child.alpha = 1
                 self.selected += 1
                 if touch.pos[1] <= self.y+child.y+child.height: break 
-            Logger.debug("Cards: selected %d out of %d cards" % (self.selected, self.cards()))
+            Logger.debug("Cards: selected %d out of %d cards", self.selected, self.cards())
 
             if self.selected < self.cards():
                 self.split = self.pile.split_top_widget(self.selected)
@@ -129,12 +177,113 @@ class CardScatter(Scatter, CardsList):
             self.selected = 0
         return True
 
+    def reset(self, **kwargs):
+        self.selected = 0
+        self.split = False
+        self.lock(False)
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    # images go back in the pool too
+    def recycle(self, pool):
+        for img in self.images:
+            self.remove_widget(img)
+            pool.release(img)
+        self.images = []
+        self.callback = None
+        self.pile = None
+
     # make the scatter not movable if covered
     def lock(self, state):
         self.auto_bring_to_front = not state
         self.do_translation_x = not state
         self.do_translation_y = not state
 
+# covered cards drawn as strips on one widget's canvas rather than a widget each -
+# face down runs in the tableau, and everything under the top card of a pile which
+# isn't fanned. Cards come off one at a time and aren't touchable.
+class CardStack(Widget):
+    images = []
+    split = False
+    stacked = True
+
+    def __init__(self, **kwargs):
+        self.stack = []
+        self.rects = []
+        super(CardStack, self).__init__()
+        with self.canvas:
+            Color(1, 1, 1, 1)
+        self.bind(pos=self.update)
+        self.reset(**kwargs)
+
+    def cards(self): return len(self.stack)
+
+    def card_list(self): return list(self.stack)
+
+    def top_card(self): return self.stack[-1] if self.stack else None
+
+    def bottom_card(self): return self.stack[0]
+
+    def lock(self, state): pass
+
+    def reset(self, csize=(0, 0), step=(0, 0), pos=(0, 0)):
+        self.csize, self.step = csize, step
+        self.size = csize
+        self.pos = pos
+
+    def recycle(self, pool):
+        for rect in self.rects: self.canvas.remove(rect)
+        self.stack, self.rects = [], []
+
+    def fanned(self): return self.step != (0, 0)
+
+    # grows down and right like a scatter, so pos is the bottom left of the top card
+    def push(self, card):
+        self.stack.append(card)
+        if len(self.stack) > 1:
+            xstep, ystep = self.step
+            self.width += xstep
+            self.height += ystep
+            self.y -= ystep
+        if self.fanned() or not self.rects:
+            rect = Rectangle(size=self.csize)
+            self.canvas.add(rect)
+            self.rects.append(rect)
+        self.rects[-1].source = card.image()
+        self.update()
+
+    def pop(self):
+        card = self.stack.pop()
+        if self.fanned():
+            self.canvas.remove(self.rects.pop())
+        elif self.stack:
+            self.rects[-1].source = self.stack[-1].image()
+        else:
+            self.canvas.remove(self.rects.pop())
+        if self.stack:
+            xstep, ystep = self.step
+            self.width -= xstep
+            self.height -= ystep
+            self.y += ystep
+        self.update()
+        return card
+
+    def update(self, *args):
+        xstep, ystep = self.step
+        n = len(self.rects)
+        for i, rect in enumerate(self.rects):
+            rect.pos = (self.x + i*xstep, self.y + (n-1-i)*ystep)
+
+    def resize(self, xpos, ypos, size, xstep=0, ystep=0):
+        n = len(self.stack)
+        self.csize, self.step = size, (xstep, ystep)
+        self.size = (size[0] + (n-1)*xstep, size[1] + (n-1)*ystep)
+        self.pos = (xpos, ypos - (n-1)*ystep)
+        for rect in self.rects: rect.size = size
+        self.update()
+        return xpos + n*xstep, ypos - n*ystep
+
+
 class Pile():
     type = ''
     index = 0
@@ -145,11 +294,12 @@ class Pile():
         self.fan = fan
         self.show_count = show_count
         game.position_pile(self)
-        Logger.debug("Cards: new pile type=%s pos=%d %d fan=%s %d %d counter=%s" % 
-                    (self.type, col, row, fan, self.xstep, self.ystep, show_count))
+        Logger.debug("Cards: new pile type=%s pos=%d %d fan=%s %d %d counter=%s",
+                     self.type, col, row, fan, self.xstep, self.ystep, show_count)
         self.game = game
         self.layout = game.layout
         self.widgets = []
+        self.ncards = 0
         self.counter = None
         self.add_base(Card.base_image(suit), on_touch)
         self.clear(1)
@@ -169,44 +319,28 @@ class Pile():
 
     def __str__(self): return "%s%d" % self.pid()
 
-    # position of tiop of pile
-    def top_pos(self, offset=0):
-        x, y = self.x, self.y
-        for w in self.widgets[1:]:
-            ncards = w.cards()
-            x += ncards*self.xstep
-            y -= ncards*self.ystep
-        return x-offset*self.xstep, y+offset*self.ystep
-
-    # build rules
-    def by_rank(self, card, base=None, order=1, suit=None, wrap=False):
-        if suit is not None and card.suit != suit:
-            return False
-        else:
-            if self.size() ==0:
-                return base is None or card.rank == base
-            else:
-                top = self.top().top_card()
-                return card.rank == top.next_rank(order,wrap)
+    # top num card images, or the base if pile is empty
+    def top_images(self, num):
+        images = [img for w in self.widgets[1:] for img in w.images]
+        return images[-num:] if images else self.base().images
 
-    def by_alt_color(self, card, base=None, order=1, wrap=False):
-        if self.size() == 0:
-            return base is None or card.rank == base
-        else:    
-            top = self.top().top_card()
-            return card.color() != top.color() and card.rank == top.next_rank(order,wrap)
+    # position of top of pile - from running count of cards so no need to walk the widgets
+    def top_pos(self, offset=0):
+        n = self.ncards - offset
+        return self.x + n*self.xstep, self.y - n*self.ystep
 
     def counter_pos(self):
+        xsize, ysize = self.game.counter_size
         if self.show_count == 'right':
-            return self.x+self.csize[0], self.y+(self.csize[1]-Counter.ysize)/2
+            return self.x+self.csize[0], self.y+(self.csize[1]-ysize)/2
         elif self.show_count == 'left':
-            return self.x-Counter.xsize, self.y+(self.csize[1]-Counter.ysize)/2
+            return self.x-xsize, self.y+(self.csize[1]-ysize)/2
         else:
-            return self.x+(self.csize[0]-Counter.xsize)/2, self.y-Counter.ysize
+            return self.x+(self.csize[0]-xsize)/2, self.y-ysize
 
     # bottom of pile
     def add_base(self, image, on_touch):
-        self.widgets.append(CardImage(source=image, size=self.csize, pos=(self.x,self.y)))
+        self.widgets.append(POOL.get(CardImage, source=image, size=self.csize, pos=(self.x,self.y)))
         if on_touch:
             self.base().callback = on_touch
         self.layout.add_widget(self.base())
@@ -214,10 +348,25 @@ class Pile():
             self.counter = Counter(pos=self.counter_pos())
             self.layout.add_widget(self.counter)
  
+    def geometry(self): return self.x, self.y, self.xstep, self.ystep, self.csize
+
+    # update after screen resize from old geometry - just shift the widgets if the
+    # card size is the same
+    def relayout(self, old):
+        x, y, xstep, ystep, csize = old
+        if (xstep, ystep, csize) != (self.xstep, self.ystep, self.csize):
+            self.redraw()
+        elif (x, y) != (self.x, self.y):
+            dx, dy = self.x-x, self.y-y
+            for w in self.widgets:
+                w.pos = (w.x+dx, w.y+dy)
+            if self.counter:
+                self.counter.pos = self.counter_pos()
+
     # redraw after screen resize
     def redraw(self):
         xpos, ypos = self.x, self.y
-        Logger.debug("Cards: redraw pile %s at %d,%d" % (self, xpos, ypos))
+        Logger.debug("Cards: redraw pile %s at %d,%d", self, xpos, ypos)
         # resize base of pile
         self.widgets[0].resize(xpos, ypos, self.csize)
         if self.counter:
@@ -231,7 +380,9 @@ class Pile():
     def clear(self, base):
         for w in self.widgets[base:]:
             self.layout.remove_widget(w)            
+            POOL.release(w)
         del self.widgets[base:]
+        self.ncards = 0
         if self.counter: 
             if base == 0: self.layout.remove_widget(self.counter)
             self.counter.count = 0
@@ -243,35 +394,84 @@ class Pile():
             self.add_card(c)
         return len(cards)
 
-    # add card onto top 
+    def fanned(self): return bool(self.xstep or self.ystep)
+
+    # add card onto top - face down cards go on a stack, and so do covered cards if
+    # the pile isn't fanned, so only cards which can be picked up are widgets
+    @timed('add_card')
     def add_card(self, card):
         #Logger.debug("cards: add %s to %s %d" % (card, self.type, self.index))
         top = self.top()
-        img = CardImage(card=card, source=card.image(), size=self.csize)
-        if (card.faceup and self.type != 'waste' and
-                top.top_card() and top.top_card().faceup and 
+        if not card.faceup:
+            if not top.stacked:
+                if not self.fanned(): top = self.fold()
+                else: top = self.new_stack()
+            top.push(card)
+        elif (self.fanned() and self.type != 'waste' and not top.stacked and
+                top.top_card() and top.top_card().faceup and
                 self.game.can_join(self, card) ):
             #Logger.debug("cards: add to existing scatter")
+            img = POOL.get(CardImage, card=card, source=card.image(), size=self.csize)
             top.add_image(img, step=True)
         else:
-            if card.faceup:
-                top = CardScatter(size=self.csize, pos=self.top_pos(), 
-                        callback=self.on_release, pile=self)
-                top.add_image(img)
-            else:
-                img.pos = self.top_pos()
-                top = img
+            if not self.fanned() and self.size() > 0: self.fold()
+            img = POOL.get(CardImage, card=card, source=card.image(), size=self.csize)
+            top = POOL.get(CardScatter, size=self.csize, pos=self.top_pos(), 
+                    callback=self.on_release, pile=self)
+            top.add_image(img)
             # lock underneath widgets so we can't move em
             for under in self.widgets: under.lock(True)
             self.layout.add_widget(top)
             self.widgets.append(top)
-        if self.counter: self.counter.count += 1
+        self.ncards += 1
+        if self.counter: self.counter.count = self.ncards
+
+    def new_stack(self):
+        stack = POOL.get(CardStack, csize=self.csize, step=(self.xstep, self.ystep),
+                         pos=self.top_pos())
+        self.layout.add_widget(stack)
+        self.widgets.append(stack)
+        return stack
+
+    # move the card on top of a pile which isn't fanned onto the stack under it
+    def fold(self):
+        top = self.top()
+        if top.stacked: return top
+        if self.size() == 0: return self.new_stack()
+        self.widgets.pop()
+        self.layout.remove_widget(top)
+        stack = self.top() if self.size() > 0 else self.new_stack()
+        for card in top.card_list(): stack.push(card)
+        POOL.release(top)
+        return stack
+
+    # and back again, so the top card can be picked up
+    def unfold(self):
+        if self.fanned() or self.size() == 0: return
+        top = self.top()
+        if not (top.stacked and top.top_card().faceup): return
+        card = top.pop()
+        if top.cards() == 0:
+            self.widgets.pop()
+            self.layout.remove_widget(top)
+            POOL.release(top)
+        self.ncards -= 1
+        self.add_card(card)
+
+    # take the top widget, or one card from a stack
     def remove_cards(self):
         if self.size() == 0: return []
-        w = self.widgets.pop()
-        self.layout.remove_widget(w)
-        if self.counter: self.counter.count -= w.cards()
-        return w.card_list()
+        w = self.top()
+        if w.stacked and w.cards() > 1:
+            cards = [w.pop()]
+        else:
+            self.widgets.pop()
+            self.layout.remove_widget(w)
+            cards = w.card_list()
+            POOL.release(w)
+        self.ncards -= len(cards)
+        if self.counter: self.counter.count = self.ncards
+        return cards
     
     def take_cards(self, expose=False, flip=False):
         cards = self.remove_cards()
@@ -291,25 +491,26 @@ class Pile():
         return dest.add_cards(cards)
     def move_num_cards_to(self, dest, total, expose=False, cover=False, flip=False):
         moved = 0
-        while moved < total:
-            num = self.top().cards()
+        while moved < total and self.size() > 0:
+            num = 1 if self.top().stacked else self.top().cards()
             if moved + num <= total:
                 moved += self.move_cards_to(dest, expose, cover, flip)
             else:
                 ok = self.split_top_widget(total-moved)
-                if not ok: return
+                if not ok: break
+        self.unfold()
 
     # split the scatter on top into two as we've partally grabbed it
     # note: assumes fan='down'
     def split_top_widget(self, selected):
         top = self.top()
         if top.cards() <= selected:
-            Logger.warning("Cards: can't split %d out of %d" % (selected, top.cards()))
+            Logger.warning("Cards: can't split %d out of %d", selected, top.cards())
             return False
         self.layout.remove_widget(top)
         ypos = top.y + top.cards()*self.ystep
         size = (self.csize[0], self.csize[1]-self.ystep)
-        under = CardScatter(size=size, pos=(top.x, ypos), callback=top.callback, pile=self)
+        under = POOL.get(CardScatter, size=size, pos=(top.x, ypos), callback=top.callback, pile=self)
         for _ in range(top.cards()-selected):
             under.add_image(top.remove_image(), step=True)
         self.widgets.insert(-1, under)
@@ -321,28 +522,25 @@ class Pile():
     def move_cards_back(self):
         w = self.top()
         if w.split:
-            Logger.debug("Cards: rejoin split pile - cards=%d" % w.cards())
+            Logger.debug("Cards: rejoin split pile - cards=%d", w.cards())
             self.move_cards_to(self)
         else:
             w.pos = self.top_pos(1)
 
-    # writes cards on stack to config file
-    def save(self, config):
-        data = []
-        for group in self.widgets[1:]:
-            data += [card.export() for card in group.card_list()]
-        config.set('piles', str(self), data)
+    # rebuild the widgets from the board model
+    def sync(self):
+        self.clear(1)
+        for card in self.game.board.cards(self.pid()):
+            self.add_card(Card.decode(card))
 
-    # read back the data
+    # read back a game saved in the config file by older versions
     def load(self, config):
         name = str(self)
-        self.clear(1)
+        cards = []
         if config.has_option('piles', name):
             cards = ast.literal_eval(config.get('piles', name))
-            for card in cards:
-                self.add_card(Card(*card))
-            if self.counter: 
-                self.counter.count = len(cards)
+        self.game.board.load(self.pid(), cards)
+        self.sync()
 
 
 # types of pile
@@ -355,9 +553,11 @@ class Tableau(Pile):
 class Waste(Pile):
     type = 'waste'
 
+POOL = WidgetPool()
+
+PILE_TYPES = dict(foundation=Foundation, tableau=Tableau, waste=Waste)
+
 
 # label with no. of cards in pile
 class Counter(Label):
-    count = NumericProperty(0)
-    xsize = Window.width*0.03
-    ysize = Window.height*0.03
\ No newline at end of file
+    count = NumericProperty(0)
\ No newline at end of file
@@ -0,0 +1,56 @@
+from cards import RANK, SUIT, COLOR, SUITS, SUIT_SHIFT, Deck, next_rank
+
+# declarative build rules, compiled into lookup tables when a pile is added so
+# can_add is a couple of index operations rather than a chain of rule checks.
+# headless like the board - no kivy imports allowed in this module
+
+# card codes without the face up flag - rank and suit fit in 6 bits
+CARD_MASK = 0x3f
+NUM_CARDS = CARD_MASK + 1
+
+
+# what can be built on a pile:
+#   base  - rank which can go on an empty pile, None for any card
+#   order - rank of each card relative to the one below, e.g. -1 to build down
+#   wrap  - king and ace are next to each other
+#   suit  - must follow the suit of the pile
+#   color - 'alt' or 'same' colour as the card below, None for either
+#   group - most cards which can be moved on at once, None for no limit
+class Rule(object):
+
+    def __init__(self, base=None, order=1, wrap=False, suit=False, color=None, group=None):
+        self.base = base
+        self.order = order
+        self.wrap = wrap
+        self.suit = suit
+        self.color = color
+        self.group = group
+        self.tables = {}
+
+    def accepts(self, top, card, suit):
+        if self.suit and suit is not None and SUIT[card] != suit:
+            return False
+        if top is None:
+            return self.base is None or RANK[card] == self.base
+        if self.color == 'alt' and COLOR[card] == COLOR[top]: return False
+        if self.color == 'same' and COLOR[card] != COLOR[top]: return False
+        return RANK[card] == next_rank(RANK[top], self.order, self.wrap)
+
+    # tables for a pile with given suit - which cards can go on an empty pile, and
+    # which on each top card, indexed by top << 6 | card. Built once per suit.
+    def compile(self, suit=None):
+        if not self.suit: suit = None
+        if suit not in self.tables:
+            self.tables[suit] = self.build(suit)
+        return self.tables[suit]
+
+    def build(self, suit):
+        cards = [rank | SUITS.index(s) << SUIT_SHIFT for s in SUITS
+                 for rank in range(Deck.ace, Deck.king+1)]
+        empty = bytearray(NUM_CARDS)
+        table = bytearray(NUM_CARDS*NUM_CARDS)
+        for card in cards:
+            empty[card] = self.accepts(None, card, suit)
+            for top in cards:
+                table[top << 6 | card] = self.accepts(top, card, suit)
+        return bytes(empty), bytes(table), self.group
@@ -0,0 +1,199 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+from functools import partial
+
+os.environ['KIVY_NO_ARGS'] = '1'
+
+from cards import Deck, FACEUP, deal_id, encode
+from solver import Solver
+from dealpool import new_workers
+
+# play many seeded deals headless to measure win rates and game lengths, using the
+# rules from games.py and the solver's move ordering. Deals are shared out across a
+# pool of worker processes and each result is written as a line of json, e.g.
+#   python simulate.py --game Klondike --deal-by 3 --policy greedy --deals 100000 --out k3.jsonl
+# Policies:
+#   greedy - best move first by the solver's ordering, foundation moves before anything else
+#   random - any legal move
+#   solver - follow the solver's line from the deal, then greedy if it runs out
+# Check the policies still find the moves in CHECKS before trusting the figures:
+#   python simulate.py --game Klondike --check
+
+POLICIES = ('greedy', 'random', 'solver')
+
+
+# game rules with deal_by changed, e.g. Klondike dealing three at a time
+def game_class(name, deal_by=None):
+    import games
+    cls = getattr(games, name)
+    if deal_by is None or getattr(cls, 'deal_by', None) in (None, deal_by):
+        return cls
+    return type('%s%d' % (name, deal_by), (cls,), {'deal_by': deal_by})
+
+
+class Simulation(object):
+
+    def __init__(self, game, deal_by=None, policy='greedy', max_moves=1000, max_nodes=20000):
+        self.name = game
+        self.policy = policy
+        self.max_moves = max_moves
+        self.solver = Solver(game_class(game, deal_by), max_nodes=max_nodes)
+        self.game = self.solver.game
+        self.deck = Deck(self.game.decks)
+
+    # moves to try in turn from the current position
+    def order(self, board, rand, plan):
+        if self.policy == 'random':
+            moves = list(self.game.legal_moves())
+            rand.shuffle(moves)
+            return moves
+        moves = self.solver.moves(board)
+        if plan: moves.insert(0, plan.pop(0))
+        return moves
+
+    # play one deal to the end - it is lost when there is no move to a new position
+    def play(self, seed):
+        start = time.time()
+        solver, game = self.solver, self.game
+        self.deck.rewind(shuffle=True, seed=seed)
+        board = solver.deal(self.deck)
+        rand = random.Random(seed)
+        plan = []
+        if self.policy == 'solver':
+            status, plan = solver.solve(board.copy())
+            plan = list(plan)
+        seen = set([solver.key(board)])
+        moves = 0
+        while moves < self.max_moves:
+            game.board = board
+            if game.finished(): break
+            for i, move in enumerate(self.order(board, rand, plan)):
+                child = board.copy()
+                game.board = child
+                game.play(move)
+                key = solver.key(child)
+                if key not in seen:
+                    seen.add(key)
+                    board = child
+                    moves += 1
+                    # off the solver's line, so the rest of it is no use
+                    if i > 0: del plan[:]
+                    break
+            else:
+                break
+        game.board = board
+        return dict(seed=seed, deal=deal_id(seed), won=game.finished(), moves=moves,
+                    foundation=board.count('foundation'), time=round(time.time()-start, 4))
+
+
+# positions which a policy must be able to play from - each returns the board and
+# a test for the move, or None if the game doesn't have the piles for it
+def lone_waste_king(board):
+    if len(board.pids('waste')) < 2: return None
+    stock, waste = board.pids('waste')[:2]
+    for pid in board.pids(): board.set(pid, [])
+    board.set(stock, [encode(5, 's'), encode(6, 'c')])
+    board.set(waste, [encode(Deck.king, 'h', faceup=True)])
+    board.set(board.pids('tableau')[1], [encode(3, 'd', faceup=True)])
+    return lambda move: move[0] == waste and move[1][0] == 'tableau'
+
+CHECKS = {'lone king on the waste goes to an empty column': lone_waste_king}
+
+# (name, passed) for each check which applies to the game - it fails if the
+# policy never offers the move
+def check(sim):
+    results = []
+    for name, setup in sorted(CHECKS.items()):
+        deck = sim.deck
+        deck.rewind(shuffle=True, seed=0)
+        board = sim.solver.deal(deck)
+        wanted = setup(board)
+        if wanted is None: continue
+        sim.game.board = board
+        moves = sim.order(board, random.Random(0), [])
+        results.append((name, any(wanted(move) for move in moves)))
+    return results
+
+
+# run in worker process - one simulation per process, kept between batches
+_simulations = {}
+
+def play_deals(spec, seeds):
+    sim = _simulations.get(spec)
+    if sim is None:
+        sim = _simulations[spec] = Simulation(*spec)
+    return [sim.play(seed) for seed in seeds]
+
+def percentiles(values):
+    if len(values) < 2: return values
+    cuts = statistics.quantiles(values, n=10)
+    return [cuts[0], statistics.median(values), cuts[-1]]
+
+def summary(results, elapsed):
+    won = [r['moves'] for r in results if r['won']]
+    lines = ["%d deals in %.1fs, %.1f deals/s" % (len(results), elapsed, len(results)/elapsed),
+             "won %d (%.1f%%)" % (len(won), 100.0*len(won)/max(len(results), 1)),
+             "foundation cards: mean %.1f" % statistics.mean(r['foundation'] for r in results)]
+    if won:
+        lines.append("moves to win: mean %.1f, p10/median/p90 %s" % (
+                     statistics.mean(won), '/'.join('%g' % m for m in percentiles(won))))
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description='Play solitaire deals headless for win statistics')
+    parser.add_argument('--game', default='Klondike')
+    parser.add_argument('--deal-by', type=int, default=None, help='cards dealt from the stock')
+    parser.add_argument('--policy', choices=POLICIES, default='greedy')
+    parser.add_argument('--deals', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-moves', type=int, default=1000)
+    parser.add_argument('--nodes', type=int, default=20000, help='solver budget per deal')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--batch', type=int, default=50, help='deals per task')
+    parser.add_argument('--out', help='write a json line per deal to this file')
+    parser.add_argument('--check', action='store_true', help='only check the policy on set positions')
+    args = parser.parse_args()
+
+    spec = (args.game, args.deal_by, args.policy, args.max_moves, args.nodes)
+    if args.check:
+        results = check(Simulation(*spec))
+        for name, passed in results: print("%s %s" % ('ok' if passed else 'FAILED', name))
+        failed = sum(1 for _, passed in results if not passed)
+        print("%d of %d checks passed" % (len(results)-failed, len(results)))
+        sys.exit(1 if failed else 0)
+    seeds = range(args.seed, args.seed+args.deals)
+    batches = [seeds[i:i+args.batch] for i in range(0, len(seeds), args.batch)]
+    out = open(args.out, 'w') if args.out else None
+    results = []
+    start = time.time()
+    workers = new_workers(args.workers)
+    try:
+        for batch in workers.imap_unordered(partial(play_deals, spec), batches):
+            results += batch
+            if out:
+                for result in batch:
+                    out.write(json.dumps(dict(result, game=args.game, deal_by=args.deal_by,
+                                              policy=args.policy)) + '\n')
+                out.flush()
+            done = len(results)
+            if sys.stderr.isatty():
+                sys.stderr.write("\r%d/%d deals, %.1f/s" % (done, args.deals, done/(time.time()-start)))
+    except KeyboardInterrupt:
+        workers.terminate()
+        print("\ninterrupted")
+    else:
+        workers.close()
+    finally:
+        workers.join()
+        if out: out.close()
+    if sys.stderr.isatty(): sys.stderr.write("\n")
+    if results:
+        print(summary(results, time.time()-start))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import os
+import mmap
+import struct
+
+from kivy.logger import Logger
+
+# saved game state as a compact binary file, read back in one pass:
+#   header - magic, version, deck seed (-1 if none), score, moves, max moves,
+#            milliseconds on the game clock, flags
+#   game name, deck card order, then each pile as kind, index and card codes
+# Cards are board codes, so face state is kept in each byte. The move history is
+# in the journal, so the size of the snapshot doesn't grow with the game.
+MAGIC = b'SOLS'
+KINDS = ('tableau', 'foundation', 'waste')
+HEADER = struct.Struct('<4sHqiIIiB')
+BLOCK = struct.Struct('<H')
+PILE = struct.Struct('<BBH')
+WON = 0x01
+
+class Snapshot(object):
+    version = 2
+
+    def __init__(self, name='', seed=None, deck=b'', score=0, moves=0, max_moves=0,
+                 elapsed=0, won=False, piles=()):
+        self.name = name
+        self.seed = seed
+        self.deck = deck
+        self.score = score
+        self.moves = moves
+        self.max_moves = max_moves
+        self.elapsed = elapsed
+        self.won = won
+        self.piles = piles
+
+    def pack(self):
+        seed = -1 if self.seed is None else self.seed
+        flags = WON if self.won else 0
+        name = self.name.encode('utf-8')
+        data = [HEADER.pack(MAGIC, self.version, seed, self.score, self.moves,
+                            self.max_moves, self.elapsed, flags),
+                BLOCK.pack(len(name)), name,
+                BLOCK.pack(len(self.deck)), bytes(self.deck),
+                BLOCK.pack(len(self.piles))]
+        for (kind, index), cards in self.piles:
+            data += [PILE.pack(KINDS.index(kind), index, len(cards)), bytes(cards)]
+        return b''.join(data)
+
+    # write to a temporary file and rename over the old one, so a crash while
+    # saving leaves the previous snapshot intact
+    def write(self, path):
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(self.pack())
+        os.replace(tmp, path)
+
+    @staticmethod
+    def unpack(data):
+        magic, version, seed, score, moves, max_moves, elapsed, flags = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version not in (1, Snapshot.version):
+            raise ValueError("not a version %d snapshot" % Snapshot.version)
+        # version 1 kept seconds left of the ten minute countdown
+        if version == 1:
+            elapsed = 1000*(600 - elapsed)
+        offset = HEADER.size
+        blocks = []
+        for _ in range(2):
+            size, = BLOCK.unpack_from(data, offset)
+            offset += BLOCK.size
+            blocks.append(data[offset:offset+size])
+            offset += size
+        count, = BLOCK.unpack_from(data, offset)
+        offset += BLOCK.size
+        piles = []
+        for _ in range(count):
+            kind, index, size = PILE.unpack_from(data, offset)
+            offset += PILE.size
+            piles.append(((KINDS[kind], index), data[offset:offset+size]))
+            offset += size
+        if offset != len(data):
+            raise ValueError("snapshot is %d bytes, expected %d" % (len(data), offset))
+        return Snapshot(blocks[0].decode('utf-8'), None if seed < 0 else seed, blocks[1],
+                        score, moves, max_moves, elapsed, bool(flags & WON), piles)
+
+    # memory map the file and decode it, None if it is missing or unreadable
+    @staticmethod
+    def read(path):
+        if not os.path.exists(path): return None
+        try:
+            with open(path, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    return Snapshot.unpack(data)
+        except (ValueError, IndexError, struct.error, OSError) as e:
+            Logger.warning("Cards: ignoring snapshot %s - %s", path, e)
+            return None
@@ -0,0 +1,178 @@
+import os
+import time
+import argparse
+
+from cards import RANK, COLOR, FACEUP, Deck, encode, deal_id
+
+# search for a winning sequence of moves using a headless copy of the game
+# iterative deepening depth first search with a transposition table, within a
+# budget of nodes and/or seconds. Moves are (src, dst, num, flip) tuples.
+
+SOLVED, LOST, UNKNOWN = 'solved', 'lost', 'unknown'
+
+class OutOfBudget(Exception):
+    pass
+
+
+class Solver(object):
+    start_depth = 200
+
+    def __init__(self, game_class, max_nodes=100000, max_time=None, max_depth=800):
+        self.game = game_class()
+        self.game.build()
+        self.max_nodes = max_nodes
+        self.max_time = max_time
+        self.max_depth = max_depth
+
+    # new deal straight from the deck using the game's own start rules
+    def deal(self, deck):
+        game = self.game
+        game.board.clear(1)
+        deck.rewind()
+        for pid in game.deal_order():
+            game.start(pid, deck)
+        return game.board.copy()
+
+    # search from given board, returns status and list of moves
+    def solve(self, board):
+        self.nodes = 0
+        self.seen = {}
+        self.best, self.best_path = None, []
+        self.stop_time = time.time() + self.max_time if self.max_time else None
+        path = []
+        depth = self.start_depth
+        try:
+            while True:
+                self.cutoff = False
+                if self.search(board, depth, path):
+                    return SOLVED, path
+                if not self.cutoff:
+                    return LOST, []
+                if depth >= self.max_depth:
+                    return UNKNOWN, self.best_path
+                depth = min(depth*2, self.max_depth)
+        except OutOfBudget:
+            return UNKNOWN, self.best_path
+
+    # best next move - the first step of a solution or the most promising line
+    def hint(self, board):
+        status, moves = self.solve(board)
+        if moves:
+            return moves[0]
+        self.game.board = board.copy()
+        moves = self.moves(self.game.board)
+        return moves[0] if moves and status != LOST else None
+
+    def search(self, board, depth, path):
+        self.nodes += 1
+        if self.nodes > self.max_nodes:
+            raise OutOfBudget()
+        if self.stop_time and self.nodes % 256 == 0 and time.time() > self.stop_time:
+            raise OutOfBudget()
+        game = self.game
+        game.board = board
+        if game.finished():
+            return True
+        score = self.evaluate(board)
+        if self.best is None or score > self.best:
+            self.best, self.best_path = score, list(path)
+        key = self.key(board)
+        if self.seen.get(key, -1) >= depth:
+            return False
+        self.seen[key] = depth
+        if depth == 0:
+            self.cutoff = True
+            return False
+        for move in self.moves(board):
+            child = board.copy()
+            game.board = child
+            game.play(move)
+            path.append(move)
+            if self.search(child, depth-1, path):
+                return True
+            path.pop()
+        return False
+
+    # position key - order of tableau piles does not matter
+    def key(self, board):
+        piles = board.piles
+        tableau = sorted(bytes(piles[pid]) for pid in board.pids('tableau'))
+        return tuple(tableau) + tuple(bytes(piles[pid]) for pid in board.order if pid[0] != 'tableau')
+
+    # more cards on foundations and fewer face down is better
+    def evaluate(self, board):
+        facedown = sum(1 for pid in board.pids('tableau') for card in board.cards(pid) if not card & FACEUP)
+        return 4*board.count('foundation') - facedown
+
+    # can card go to the foundation without ever being needed in the tableau?
+    def safe(self, board, card):
+        rank = RANK[card]
+        if rank <= Deck.ace+1: return True
+        for pid in board.pids('foundation'):
+            suit = board.suit(pid)
+            if suit is None: return False
+            if COLOR[encode(Deck.ace, suit)] != COLOR[card]:
+                top = board.top(pid)
+                if top is None or RANK[top] < rank-1: return False
+        return True
+
+    # legal moves ordered best first, with useless moves pruned
+    def moves(self, board):
+        found, expose, other, deal, back = [], [], [], [], []
+        for move in self.game.legal_moves():
+            src, dst, num, flip = move
+            if flip:
+                deal.append(move)
+            elif dst[0] == 'foundation':
+                if self.safe(board, board.top(src)):
+                    return [move]
+                found.append(move)
+            elif src[0] == 'foundation':
+                back.append(move)
+            elif src[0] == 'tableau' and board.size(src) == num:
+                # moving a whole column to an empty one gains nothing - but the
+                # last card on the waste can still go to an empty column
+                if board.size(dst) > 0: other.append(move)
+            elif not board.is_split(src, num):
+                expose.append(move)
+            elif src[0] != 'tableau' or not self.seated(board, src, num):
+                other.append(move)
+        return found + expose + other + deal + back
+
+    # is the group already sitting on a card it could be built on? moving it is
+    # only useful if the card underneath can then go to a foundation
+    def seated(self, board, src, num):
+        base, under = board.card(src, num), board.card(src, num+1)
+        if COLOR[base] == COLOR[under] or RANK[under] != RANK[base]+1:
+            return False
+        return not any(board.by_rank(dst, under, base=Deck.ace, suit=board.suit(dst))
+                       for dst in board.pids('foundation'))
+
+
+# command line batch solver
+def main():
+    import games
+    parser = argparse.ArgumentParser(description='Solve solitaire deals')
+    parser.add_argument('--game', default='Klondike')
+    parser.add_argument('--deals', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--nodes', type=int, default=100000)
+    parser.add_argument('--time', type=float, default=None)
+    args = parser.parse_args()
+
+    solver = Solver(getattr(games, args.game), max_nodes=args.nodes, max_time=args.time)
+    deck = Deck(solver.game.decks)
+    totals = {SOLVED: 0, LOST: 0, UNKNOWN: 0}
+    start = time.time()
+    for seed in range(args.seed, args.seed+args.deals):
+        deck.rewind(shuffle=True, seed=seed)
+        t = time.time()
+        status, moves = solver.solve(solver.deal(deck))
+        totals[status] += 1
+        print("%s deal %s: %s in %d moves, %d nodes, %.2fs" % (
+              args.game, deal_id(seed), status, len(moves), solver.nodes, time.time()-t))
+    print("%d deals in %.2fs: %s" % (args.deals, time.time()-start, totals))
+
+if __name__ == '__main__':
+    os.environ['KIVY_NO_ARGS'] = '1'
+    main()
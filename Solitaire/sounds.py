@@ -0,0 +1,63 @@
+import threading
+
+from kivy.clock import mainthread
+from kivy.logger import Logger
+
+# sound effects - file and number of voices, so effects which overlap such as a
+# chain of auto drop moves each get their own instance rather than restarting one
+EFFECTS = {
+    'start': ('SS.mp3', 1),
+    'flip': ('44444.mp3', 4),
+}
+
+# effects are decoded on a background thread once the app is up, so nothing is
+# loaded at import time and the UI thread never waits on the audio. Until then,
+# or if there is no audio device, play does nothing.
+class Sounds(object):
+
+    def __init__(self):
+        self.voices = {}
+        self.next = {}
+        self.thread = None
+
+    # start loading - then plays the named effect, if given, when it is ready
+    def load(self, then=None):
+        if self.thread is not None: return
+        self.thread = threading.Thread(target=self.load_all, args=(then,), name='sounds')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def load_all(self, then):
+        from kivy.core.audio import SoundLoader
+        for name, (path, count) in EFFECTS.items():
+            voices = []
+            for _ in range(count):
+                sound = SoundLoader.load(path)
+                if sound is None: break
+                voices.append(sound)
+            Logger.debug("Cards: loaded %d voices for %s", len(voices), name)
+            if voices: self.loaded(name, voices)
+        if then: self.loaded_all(then)
+
+    @mainthread
+    def loaded(self, name, voices):
+        self.voices[name] = voices
+        self.next[name] = 0
+
+    @mainthread
+    def loaded_all(self, then):
+        self.play(then)
+
+    # play on the next free voice, or cut off the one which started first
+    def play(self, name):
+        voices = self.voices.get(name)
+        if not voices: return
+        start = self.next[name]
+        for i in range(len(voices)):
+            index = (start+i) % len(voices)
+            if voices[index].state == 'stop': break
+        else:
+            index = start
+            voices[index].stop()
+        voices[index].play()
+        self.next[name] = (index+1) % len(voices)
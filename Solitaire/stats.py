@@ -0,0 +1,123 @@
+import time
+import sqlite3
+
+from kivy.logger import Logger
+
+# record of every finished game in sqlite, so the stats screen is a few indexed
+# queries however many games have been played. Games are queued and written in
+# one transaction at the next checkpoint rather than one commit each.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    game TEXT NOT NULL,
+    seed INTEGER,
+    moves INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    won INTEGER NOT NULL,
+    finished REAL NOT NULL,
+    -- wins in a row up to and including this game
+    streak INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS games_game ON games (game);
+CREATE INDEX IF NOT EXISTS games_won ON games (game, won, moves);
+CREATE INDEX IF NOT EXISTS games_time ON games (game, won, duration);
+CREATE INDEX IF NOT EXISTS games_streak ON games (game, streak);
+-- totals carried over from the config file, where only these were kept
+CREATE TABLE IF NOT EXISTS legacy (
+    game TEXT PRIMARY KEY,
+    played INTEGER NOT NULL,
+    won INTEGER NOT NULL,
+    best_moves INTEGER NOT NULL,
+    total_moves REAL NOT NULL
+);
+"""
+
+class Stats(object):
+    version = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.pending = []
+        self.streak = {}
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.db.execute("PRAGMA user_version=%d" % self.version)
+
+    # queue a finished game - won, or given up for a new deal
+    def record(self, game, seed, moves, score, duration, won):
+        streak = self.current_streak(game)+1 if won else 0
+        self.streak[game] = streak
+        self.pending.append((game, seed, moves, score, duration, int(won), time.time(), streak))
+
+    def flush(self):
+        if not self.pending: return
+        with self.db:
+            self.db.executemany("INSERT INTO games (game, seed, moves, score, duration, won, finished, streak) "
+                                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self.pending)
+        Logger.debug("Cards: saved %d games to stats", len(self.pending))
+        self.pending = []
+
+    def query(self, sql, *args):
+        self.flush()
+        return self.db.execute(sql, args).fetchone()
+
+    # played, won, best and average moves to win, including any totals from the config file
+    def summary(self, game):
+        played, = self.query("SELECT count(*) FROM games WHERE game = ?", game)
+        won, best, total = self.query("SELECT count(*), min(moves), coalesce(sum(moves), 0) "
+                                      "FROM games WHERE game = ? AND won = 1", game)
+        legacy = self.query("SELECT played, won, best_moves, total_moves FROM legacy WHERE game = ?", game)
+        if legacy:
+            played, won, total = played+legacy[0], won+legacy[1], total+legacy[3]
+            if legacy[2] and (best is None or legacy[2] < best): best = legacy[2]
+        return dict(played=played, won=won, best_moves=best,
+                    avg_moves=float(total)/won if won else None)
+
+    # streak of the last game played, kept so recording a game doesn't need a query
+    def current_streak(self, game):
+        if game not in self.streak:
+            row = self.db.execute("SELECT streak FROM games WHERE game = ? "
+                                  "ORDER BY id DESC LIMIT 1", (game,)).fetchone()
+            self.streak[game] = row[0] if row else 0
+        return self.streak[game]
+
+    def streaks(self, game):
+        longest, = self.query("SELECT max(streak) FROM games WHERE game = ?", game)
+        return dict(current=self.current_streak(game), longest=longest or 0)
+
+    # moves to win at each percentile, looked up through the index
+    def percentiles(self, game, points=(25, 50, 90)):
+        count, = self.query("SELECT count(*) FROM games WHERE game = ? AND won = 1", game)
+        result = {}
+        if count == 0: return result
+        for p in points:
+            offset = min(count-1, int(count*p/100.0))
+            result[p], = self.query("SELECT moves FROM games WHERE game = ? AND won = 1 "
+                                    "ORDER BY moves LIMIT 1 OFFSET ?", game, offset)
+        return result
+
+    def best_time(self, game):
+        best, = self.query("SELECT min(duration) FROM games WHERE game = ? AND won = 1", game)
+        return best
+
+    # older versions kept totals for each game in its own config section - move them here
+    def import_config(self, config, names):
+        rows = []
+        for name in names:
+            if not config.has_section(name): continue
+            get = lambda key: config.getfloat(name, key, fallback=0)
+            rows.append((name, int(get('played')), int(get('won')), int(get('best_moves')),
+                         get('avg_moves')*get('won')))
+            config.remove_section(name)
+        if rows:
+            with self.db:
+                self.db.executemany("INSERT OR REPLACE INTO legacy VALUES (?, ?, ?, ?, ?)", rows)
+            Logger.info("Cards: moved stats for %d games from config", len(rows))
+        return bool(rows)
+
+    def close(self):
+        self.flush()
+        self.db.close()